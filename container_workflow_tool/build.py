@@ -0,0 +1,200 @@
+import os
+import selectors
+
+import container_workflow_tool.utility as u
+
+# Keep at most this many bytes of error output per build
+MAX_STDERR = 64 * 1024
+
+
+class Build(object):
+    """State of a single running build process"""
+
+    def __init__(self, proc, component):
+        self.proc = proc
+        self.component = component
+        self.task = None
+        self.returncode = None
+        self._line = b""
+        self._stderr = b""
+        self._open = 2
+
+    @property
+    def stderr(self):
+        return self._stderr.decode('utf-8', errors='replace')
+
+    @property
+    def finished(self):
+        return self.returncode is not None
+
+
+class BuildMonitor(object):
+    """Watches the output of several build processes at once
+
+    Output of all the processes is read as soon as it arrives using
+    a selector, so task IDs and finished builds are reported right away
+    and no process can block on a full stderr pipe.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.selector = selectors.DefaultSelector()
+        self.running = []
+
+    def add(self, proc, component):
+        """Starts watching a process
+
+        Args:
+            proc (subprocess.Popen): Process with stdout and stderr
+                                     connected to binary pipes
+            component (str): Component built by the process
+        """
+        build = Build(proc, component)
+        self.selector.register(proc.stdout, selectors.EVENT_READ, (build, False))
+        self.selector.register(proc.stderr, selectors.EVENT_READ, (build, True))
+        self.running.append(build)
+        return build
+
+    def _read_stdout(self, build, data):
+        build._line += data
+        *lines, build._line = build._line.split(b"\n")
+        for line in lines:
+            line = line.decode('utf-8', errors='replace')
+            if build.task is None and "taskID" in line:
+                build.task = line.strip()
+                self.logger.info("{} - {}".format(build.component, build.task))
+
+    def _read_stderr(self, build, data):
+        build._stderr = (build._stderr + data)[-MAX_STDERR:]
+
+    def _finish(self, build):
+        build.returncode = build.proc.wait()
+        self.running.remove(build)
+        if build.task is None:
+            temp = "Could not find task for {}!"
+            self.logger.warning(temp.format(build.component))
+        self.logger.info("{} build has finished".format(build.component))
+        if build.stderr:
+            # Write out stderr if we encounter an error
+            self.logger.error(u._4sp(build.stderr))
+
+    def wait(self, timeout=None):
+        """Waits until at least one of the builds finishes
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds
+
+        Returns:
+            list of Build: Builds that finished while waiting
+        """
+        finished = []
+        while self.running and not finished:
+            events = self.selector.select(timeout)
+            if not events:
+                break
+            for key, mask in events:
+                build, is_stderr = key.data
+                data = os.read(key.fd, 65536)
+                if data:
+                    if is_stderr:
+                        self._read_stderr(build, data)
+                    else:
+                        self._read_stdout(build, data)
+                    continue
+                # End of output, the process is about to exit
+                self.selector.unregister(key.fileobj)
+                key.fileobj.close()
+                build._open -= 1
+                if not build._open:
+                    self._finish(build)
+                    finished.append(build)
+        return finished
+
+    def run(self):
+        """Waits for all the watched builds to finish
+
+        Returns:
+            list of Build: All builds in the order they have finished
+        """
+        finished = []
+        while self.running:
+            finished += self.wait()
+        return finished
+
+
+class BuildScheduler(object):
+    """Builds images in the order given by their dependencies
+
+    A build is started as soon as the builds of all its parent images
+    have succeeded, builds depending on a failed one are skipped.
+    """
+
+    def __init__(self, logger, jobs=None):
+        """
+        Args:
+            logger (logging.Logger): Logger used for reporting
+            jobs (int, optional): Maximum number of concurrent builds,
+                                  not limited if not set
+        """
+        self.logger = logger
+        self.jobs = jobs
+
+    @staticmethod
+    def _check_cycles(components, parents):
+        # Kahn's algorithm, whatever cannot be ordered is part of a cycle
+        remaining = {c: set(parents.get(c, ())) & set(components) for c in components}
+        ready = [c for c in components if not remaining[c]]
+        while ready:
+            done = ready.pop()
+            for c, deps in remaining.items():
+                if done in deps:
+                    deps.remove(done)
+                    if not deps:
+                        ready.append(c)
+        cycle = sorted(c for c, deps in remaining.items() if deps)
+        if cycle:
+            raise u.RebuilderError("Dependency cycle between images: "
+                                   + ", ".join(cycle))
+
+    def run(self, components, parents, start):
+        """Runs the builds
+
+        Args:
+            components (list of str): Components to build, earlier ones
+                                      are started first when possible
+            parents (dict): Sets of parent components for each component,
+                            parents that are not being built are ignored
+            start (callable): Function starting the build of a component,
+                              returns the build process (subprocess.Popen)
+
+        Returns:
+            dict: Result of every component: 'succeeded', 'failed' or 'skipped'
+        """
+        self._check_cycles(components, parents)
+        deps = {c: set(parents.get(c, ())) & set(components) for c in components}
+        results = {}
+        pending = list(components)
+        monitor = BuildMonitor(self.logger)
+        while pending or monitor.running:
+            for component in list(pending):
+                failed = [p for p in deps[component]
+                          if results.get(p) in ("failed", "skipped")]
+                if failed:
+                    msg = "Skipping {}, parent image {} has not been built."
+                    self.logger.warning(msg.format(component, failed[0]))
+                    results[component] = "skipped"
+                    pending.remove(component)
+                    continue
+                if any(results.get(p) != "succeeded" for p in deps[component]):
+                    continue
+                if self.jobs and len(monitor.running) >= self.jobs:
+                    break
+                monitor.add(start(component), component)
+                pending.remove(component)
+            if not monitor.running:
+                # Everything left depends on skipped builds
+                continue
+            for build in monitor.wait():
+                status = "succeeded" if build.returncode == 0 else "failed"
+                results[build.component] = status
+        return results
@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import sqlite3
+
+
+class DiskCache(object):
+    """Persistent key-value cache stored in an SQLite database.
+
+    Values are stored as JSON together with the time they were written,
+    so callers can decide how old an entry may be when reading it.
+    """
+
+    def __init__(self, path=None, table="cache"):
+        """
+        Args:
+            path (str, optional): Location of the database file,
+                                  keeps the data in memory only if not set
+            table (str, optional): Name of the table holding the entries
+        """
+        self.path = path
+        self.table = table
+        self._memory = {} if path is None else None
+
+    def _connect(self):
+        # A new connection for every operation keeps the cache usable from
+        # several threads and survives the file being removed in between
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY, "
+                     "value TEXT, stored REAL)".format(self.table))
+        return conn
+
+    def get(self, key, ttl=None):
+        """Returns the value stored for key
+
+        Args:
+            key (str): Key of the entry
+            ttl (int, optional): Maximum age of the entry in seconds,
+                                 entries never expire if not set
+
+        Returns:
+            Stored value or None if the entry is missing or expired
+        """
+        if self._memory is not None:
+            entry = self._memory.get(key)
+        else:
+            with self._connect() as conn:
+                query = "SELECT value, stored FROM {} WHERE key = ?"
+                entry = conn.execute(query.format(self.table), (key,)).fetchone()
+            conn.close()
+        if entry is None:
+            return None
+        value, stored = entry
+        if ttl is not None and time.time() - stored > ttl:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        """Stores value under key, replacing any previous entry"""
+        entry = (json.dumps(value, default=str), time.time())
+        if self._memory is not None:
+            self._memory[key] = entry
+            return
+        with self._connect() as conn:
+            query = "INSERT OR REPLACE INTO {} VALUES (?, ?, ?)"
+            conn.execute(query.format(self.table), (key,) + entry)
+        conn.close()
+
+    def delete(self, key):
+        """Removes the entry stored under key, if there is one"""
+        if self._memory is not None:
+            self._memory.pop(key, None)
+            return
+        if not os.path.exists(self.path):
+            return
+        with self._connect() as conn:
+            conn.execute("DELETE FROM {} WHERE key = ?".format(self.table), (key,))
+        conn.close()
+
+    def clear(self):
+        """Removes all entries from the cache"""
+        if self._memory is not None:
+            self._memory.clear()
+            return
+        if not os.path.exists(self.path):
+            return
+        with self._connect() as conn:
+            conn.execute("DELETE FROM {}".format(self.table))
+        conn.close()
@@ -34,7 +34,11 @@ class Cli(CliCommon):
         else:
             method_name = action_map[self.args.command][self.args.action]
         run_function = getattr(self.rebuilder, method_name)
-        run_function()
+        try:
+            run_function()
+        finally:
+            if self.args.koji_stats:
+                self.rebuilder.print_koji_stats()
 
 
 def run():
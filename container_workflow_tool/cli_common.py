@@ -37,6 +37,10 @@ class CliCommon(object):
                             action='append')
         parser.add_argument('--disable-klist', action='store_true',
                             help='Disables getting kerberos token by klist')
+        parser.add_argument('--jobs', type=int,
+                            help='Maximum number of builds, clones and other tasks run at once')
+        parser.add_argument('--koji-stats', action='store_true',
+                            help='Print statistics of Koji hub calls at the end of the run')
         parser.add_argument('--base', nargs='?')
         subparsers = parser.add_subparsers(dest='command')
         subparsers.required = True
@@ -57,6 +61,17 @@ class CliCommon(object):
         parsers['git'].add_argument('--rebuild-reason', help='Use a custom reason for rebuilding')
         parsers['git'].add_argument('--commit-msg', help='Use a custom message instead of the default one')
         parsers['git'].add_argument('--check-script', help='Script/command to be run when checking repositories')
+        parsers['git'].add_argument('--check-summary', help='Write results of the check script into a JSON file')
+        parsers['git'].add_argument('--no-check-cache', action='store_true',
+                                    help='Run the check script even for repositories that did not change')
+        parsers['git'].add_argument('--batch', action='store_true',
+                                    help='Write changes of all repositories into a single report instead of paging through them')
+        parsers['git'].add_argument('--report-format', choices=['text', 'json'],
+                                    help='Format of the batch report, text by default')
+        parsers['git'].add_argument('--report-size', type=int,
+                                    help='Maximum size of the patch of a single repository in the batch report, in bytes')
+        parsers['git'].add_argument('--incremental', action='store_true',
+                                    help='Only pull upstream into images whose upstream or downstream changed since the last pull')
         parsers['build'].add_argument('--repo-url', help='Set the url of a .repo file to be used when building the image')
         return parser
 
@@ -81,6 +96,8 @@ class CliCommon(object):
         --do-set             - Use a specific set of images instead of all from the config (use dist-git names)
         --tmp                - Overrides default temporary working directory
         --disable-klist      - Disables getting kerberos token by klist
+        --koji-stats         - Print statistics of Koji hub calls at the end of the run
+        --jobs               - Maximum number of builds, clones and other tasks run at once
         {args}
 """
         return action_help
@@ -100,6 +117,13 @@ class CliCommon(object):
         --commit-msg     - Use a custom message instead of the default one
         --rebuild-reason - Use a custom reason for rebuilding
         --check-script   - Script/command to be run when checking repositories
+        --check-summary  - Write results of the check script into a JSON file
+        --no-check-cache - Run the check script even for repositories that did not change
+        --batch          - Write changes of all repositories into a single report instead of paging through them (show)
+        --report-format  - Format of the batch report: text (default) or json
+        --report-size    - Maximum size of the patch of a single repository in the batch report, in bytes (default 65536)
+        --incremental    - Only pull upstream into images whose upstream or downstream changed since the last pull
+                           in the same working directory (use with --tmp)
     """
         return action_help
 
@@ -119,7 +143,8 @@ class CliCommon(object):
 
     def build_usage(self):
         action_help = """%s build image_set
-    image_set       - ID of the image set to be built. Sets can be defined in the config file
+    image_set       - ID of the image set to be built. Sets can be defined in the config file,
+                      'all' builds all sets, each image right after its parent images
     Options:
         --repo-url  - Set the url of a .repo file to be used when building the image
     """
@@ -1,5 +1,9 @@
+import os
+
 import yaml
 
+from container_workflow_tool.constants import KOJI_URL
+
 
 class Config(dict):
     def __getattr__(self, key):
@@ -28,6 +32,20 @@ class Config(dict):
         self["groups"] = config.get("groups", {})
         self["mails"] = config.get("mails", {})
         self["df_ext"] = config.get("df_ext", ".fedora")
+        self["jobs"] = config.get("jobs", 4)
+        # How upstream repositories are cloned: full, shallow or sparse
+        self["clone_strategy"] = config.get("clone_strategy", "full")
+        # Long-lived data shared between working directories (git mirrors...)
+        cache_dir = config.get("cache_dir", "~/.cache/container-workflow-tool")
+        self["cache_dir"] = os.path.expanduser(cache_dir)
+        self["koji_url"] = config.get("koji_url", KOJI_URL)
+        self["koji_batch_size"] = config.get("koji_batch_size", 50)
+        self["koji_cache_ttl"] = config.get("koji_cache_ttl", 600)
+        self["koji_workers"] = config.get("koji_workers", 4)
+        self["koji_latest_candidates"] = config.get("koji_latest_candidates", 10)
+        # Seconds a single dist-git push may take and retries of failed pushes
+        self["push_timeout"] = config.get("push_timeout", 300)
+        self["push_retries"] = config.get("push_retries", 2)
         self["raw"] = config
         commands = config.get("commands", {})
         # Parse the image layers
@@ -46,8 +64,11 @@ class Config(dict):
                 b = image["git_branch"]
                 # Use the release branch if no future branches provided
                 fb = image["git_future"] if "git_future" in image else b
+                futures = [fb]
                 # Use global commands, if does not exist per image
                 image["commands"] = image.get("commands", commands)
+                strategy = image.get("clone_strategy", self["clone_strategy"])
+                image["clone_strategy"] = strategy
                 # Use global build tag if no image specific is provided
                 tag = image[t] if t in image else self[t]
                 if "releases" in self:
@@ -55,15 +76,17 @@ class Config(dict):
                         # Replace release IDs in branches
                         if r["id"] in b:
                             b = b.replace(r["id"], r["current"])
+                        # Merge into a branch of every future release
                         if r["id"] in fb:
-                            # TODO: What if there are multiple future releases?
-                            fb = fb.replace(r["id"], r["future"][0])
+                            futures = [f.replace(r["id"], future)
+                                       for f in futures for future in r["future"]]
                         # Create build tag from release
                         if r["id"] in tag:
                             image[t] = tag.replace(r["id"], r["current"])
 
                 image["git_branch"] = b
-                image["git_future"] = fb
+                image["git_future"] = futures[0]
+                image["git_futures"] = futures
                 result.append(image)
 
             self[layer_id] = result
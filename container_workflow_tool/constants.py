@@ -37,3 +37,5 @@ actions['dockerhub'] = ['updatefulldescription', ]
 actions['utils'] = ['showconfig', 'listimages', 'listupstream', ]
 
 COMMAND = ""
+
+KOJI_URL = "https://koji.fedoraproject.org/kojihub"
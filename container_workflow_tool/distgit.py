@@ -1,20 +1,61 @@
 import os
+import sys
+import json
 import shutil
+import hashlib
 import re
+import time
+import signal
 import subprocess
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
-from git import Repo
+from git import Git, Repo
 from git.exc import GitCommandError
+from git.refs.symbolic import SymbolicReference
 
 import container_workflow_tool.utility as u
 from container_workflow_tool.utility import RebuilderError
+from container_workflow_tool.cache import DiskCache
+from container_workflow_tool.mirror import MirrorCache
+from container_workflow_tool.snapshot import SnapshotCache
+from container_workflow_tool import sync
+from container_workflow_tool.state import SyncState, STATE_DB, config_hash
+from container_workflow_tool.workdirs import WorkdirRegistry, WORKDIR_DB
+
+# Ways of cloning upstream repositories, see clone_strategy in the config
+CLONE_STRATEGIES = ("full", "shallow", "sparse")
+# Seconds to wait before the first retry of a push, doubled on every next one
+PUSH_BACKOFF = 5
+# Errors of pushes that may succeed when tried again, a push that timed out
+# may still be applied by the server so it is never retried
+TRANSIENT_ERRORS = ("Could not resolve host", "Connection timed out",
+                    "Connection reset", "Connection refused", "early EOF",
+                    "remote end hung up", "Temporary failure", "RPC failed")
+
+# Bytes of the error output of a check script kept for the report
+CHECK_OUTPUT_LIMIT = 64 * 1024
+# Formats of the change report and the default cap of a single patch in bytes
+REPORT_FORMATS = ("text", "json")
+REPORT_SIZE_LIMIT = 64 * 1024
+
+# Outcome of a check script run against a single repository
+CheckResult = collections.namedtuple("CheckResult", ["component", "status", "returncode",
+                                                     "output", "cached"])
+# Outcome of pushing a single repository, status is pushed, failed or timeout
+PushResult = collections.namedtuple("PushResult", ["component", "status", "attempts",
+                                                   "duration", "error"])
 
 
 class DistgitAPI(object):
     """Class for working with dist-git."""
 
-    def __init__(self, base_image, conf, rebuild_reason, logger):
+    def __init__(self, base_image, conf, rebuild_reason, logger, jobs=None):
         self.conf = conf
+        # Number of repositories processed concurrently
+        self.jobs = jobs if jobs else getattr(conf, "jobs", 4)
+        self.push_timeout = getattr(conf, "push_timeout", 300)
+        self.push_retries = getattr(conf, "push_retries", 2)
         self.base_image = base_image
         if not rebuild_reason:
             rebuild_reason = self.conf.rebuild_reason
@@ -22,6 +63,21 @@ class DistgitAPI(object):
         self.logger = logger if logger else u.setup_logger("dist-git")
         self.logger.name = "dist-git"
         self.df_ext = self.conf.df_ext
+        mirror_dir = os.path.join(getattr(conf, "cache_dir", ""), "mirrors")
+        self.mirrors = MirrorCache(mirror_dir, self.logger)
+        snapshot_dir = os.path.join(getattr(conf, "cache_dir", ""), "generated")
+        self.snapshots = SnapshotCache(snapshot_dir, self.logger)
+        # Results of check scripts by the script and the checked content
+        check_db = os.path.join(getattr(conf, "cache_dir", ""), "checks.db")
+        self.checks = DiskCache(check_db, table="checks")
+        # Downstream repositories known to be cloned completely
+        self.workdirs = WorkdirRegistry(os.path.join(getattr(conf, "cache_dir", ""),
+                                                     WORKDIR_DB))
+        # Known git hashes of upstream files, by upstream clone
+        self._blobs = {}
+        self.state = SyncState()
+        # Remote downstream heads seen by the last check, by component
+        self._down_heads = {}
 
         self.commit_msg = None
 
@@ -145,35 +201,120 @@ class DistgitAPI(object):
             if label in fdata:
                 self.logger.warn("Wrong label '{}' found in {}".format(label, dockerfile_path))
 
-    def check_script(self, component, script_path, component_path):
+    def _check_key(self, script_path, component_path, repo_path=None):
+        """Returns the cache key of running a script against a directory
+
+        The key covers the script, the content of the script file if it
+        is one and the git tree hash of the checked directory.
+        The script is expected to be resolved already, see _resolve_script.
+        """
+        script = script_path
+        if os.path.isfile(script_path):
+            with open(script_path, "rb") as f:
+                script += "\0" + sync.blob_hash(f.read())
+        blobs = self._clean_blobs(os.path.abspath(repo_path)) if repo_path else None
+        tree = sync.content_hash(os.path.abspath(component_path), blobs)
+        return hashlib.sha1((script + "\0" + tree).encode()).hexdigest()
+
+    @staticmethod
+    def _resolve_script(script_path):
+        """Returns the absolute path of a script file, other commands as they are
+
+        Scripts run in the checked directory, so a relative path
+        has to be resolved before.
+        """
+        if os.path.isfile(script_path):
+            return os.path.abspath(script_path)
+        return script_path
+
+    @staticmethod
+    def _run_check(script_path, component_path):
+        """Runs a check script keeping at most CHECK_OUTPUT_LIMIT bytes of stderr
+
+        Returns:
+            tuple: Exit value of the script and its (possibly truncated) stderr
+        """
+        proc = subprocess.Popen(script_path, shell=True, stderr=subprocess.PIPE,
+                                stdout=subprocess.DEVNULL, cwd=component_path)
+        output = b""
+        dropped = 0
+        with proc.stderr:
+            for chunk in iter(lambda: proc.stderr.read(65536), b""):
+                kept = chunk[:CHECK_OUTPUT_LIMIT - len(output)]
+                output += kept
+                dropped += len(chunk) - len(kept)
+        err = output.decode('utf-8', errors='replace').strip()
+        if dropped:
+            err += "\n[{} more bytes of output dropped]".format(dropped)
+        return proc.wait(), err
+
+    def check_script(self, component, script_path, component_path, repo_path=None,
+                     use_cache=True):
         """Method that runs a given script against given directory
 
         Runs the script as provided by script_path and checks its exit value.
         Prints the content of stderr when the sciprt fails (exit value != 0).
+        Results are cached by the script and the content of the directory,
+        the script is not run again for a directory that did not change.
 
         Args:
             component (string): name of the component being checked
             script_path (string): script that should be run during the check
             component_path (string): path to the directory being checked
+            repo_path (string, optional): git repository containing component_path,
+                                          used to avoid hashing its clean files
+            use_cache (bool, optional): Run the script even if a result is cached,
+                                        the cached result is replaced, if False
+
+        Returns:
+            CheckResult: Outcome of the check
         """
         template = "{name}: {status}"
-        ret = subprocess.run(script_path, shell=True, stderr=subprocess.PIPE,
-                             stdout=subprocess.DEVNULL, cwd=component_path)
-
-        if ret.returncode is not 0:
-            self.logger.info(template.format(name=component, status="Affected"))
-            err = ret.stderr.decode('utf-8').strip()
-            if err:
-                self.logger.error(u._2sp(err))
+        script_path = self._resolve_script(script_path)
+        key = self._check_key(script_path, component_path, repo_path)
+        cached = self.checks.get(key) if use_cache else None
+        if cached is not None:
+            returncode, err = cached
         else:
-            self.logger.info(template.format(name=component, status="OK"))
+            returncode, err = self._run_check(script_path, component_path)
+            self.checks.set(key, [returncode, err])
+
+        status = "Affected" if returncode != 0 else "OK"
+        self.logger.info(template.format(name=component, status=status))
+        if returncode != 0 and err:
+            self.logger.error(u._2sp(err))
+        return CheckResult(component, status, returncode, err, cached is not None)
 
-    def _do_git_reset(self, repo):
-        file_list = ['--', '.gitignore'] + self.conf.ignore_files
-        repo.git.reset(file_list)
-        # One file at a time to make sure all files get reset even on error
-        for f in file_list[1:]:
-            repo.git.checkout('--', f, with_exceptions=False)
+    def check_scripts(self, script_path, checks, summary=None, use_cache=True):
+        """Runs a script against several directories in parallel
+
+        Up to self.jobs scripts run at once, see check_script.
+
+        Args:
+            script_path (string): script that should be run during the check
+            checks (list of tuple): component name, path to the directory being
+                                    checked and optionally the git repository
+                                    containing it for every check
+            summary (string, optional): file to write the results into as JSON
+            use_cache (bool, optional): Use cached results of unchanged directories
+
+        Returns:
+            list: CheckResult of every check, in the order of checks
+        """
+        script_path = self._resolve_script(script_path)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self.check_script, check[0], script_path, *check[1:],
+                                       use_cache=use_cache)
+                       for check in checks]
+            results = [f.result() for f in futures]
+        affected = [r.component for r in results if r.status != "OK"]
+        cached = len([r for r in results if r.cached])
+        msg = "Checked repositories: {}, affected: {}, cached: {}"
+        self.logger.info(msg.format(len(results), len(affected), cached))
+        if summary:
+            with open(summary, "w") as f:
+                json.dump([r._asdict() for r in results], f, indent=2)
+        return results
 
     def get_commit_msg(self, rebase, image=None):
         """Method to create a commit message to be used in git operations
@@ -200,25 +341,38 @@ class DistgitAPI(object):
             raise RebuilderError(t.format(str(rebase)))
         return commit
 
-    def dist_git_changes(self, images, rebase=False):
+    def dist_git_changes(self, images, rebase=False, incremental=False):
         """Method to merge changes from upstream into downstream
 
         Pulls both downstream and upstream repositories into a temporary dir.
         Merge is done by copying tracked files from upstream into downstream.
+        Inputs of every pull are recorded in a state database in the
+        working directory.
 
         Args:
             rebase (bool, optional): Specify if a rebase should be done instead
+            incremental (bool, optional): Skip images whose upstream commit,
+                                          downstream branch and settings did
+                                          not change since their last pull
         """
+        self.state = SyncState(os.path.join(os.getcwd(), STATE_DB))
+        self._down_heads = {}
+        if incremental and not rebase:
+            images = self._changed_images(images)
+        repos = self.clone_downstreams(images, os.getcwd())
         try:
+            if not rebase:
+                pulled = [i for i in images if i.get("pull_upstream", True)
+                          and i["component"] in repos]
+                ups_paths = self.prepare_upstreams(pulled, "upstreams")
             for image in (images):
-                name = image["name"]
                 component = image["component"]
-                branch = image["git_branch"]
                 path = image["git_path"]
-                url = image["git_url"]
-                commands = image["commands"]
                 pull_upstr = image.get("pull_upstream", True)
-                repo = self._clone_downstream(component, branch)
+                if component not in repos:
+                    # Clone failures have already been reported
+                    continue
+                repo = repos[component]
                 df_path = os.path.join(component, "Dockerfile")
                 release = self._get_release(df_path)
                 if rebase or not pull_upstr:
@@ -232,266 +386,802 @@ class DistgitAPI(object):
                             msg = "Not creating new commit in: "
                             self.logger.info(msg + component)
                 else:
-                    ups_name = name.split('-')[0]
-                    self._pull_upstream(component, path, url, repo, ups_name, commands)
-                    self.update_dockerfile(df_path, release, self.base_image)
-                    repo.git.add("Dockerfile")
-                    # It is possible for the git repository to have no changes
-                    if repo.is_dirty():
-                        commit = self.get_commit_msg(rebase, image)
-                        if commit:
-                            repo.git.commit("-m", commit)
-                        else:
-                            msg = "Not creating new commit in: "
-                            self.logger.info(msg + component)
+                    ups_path = ups_paths[component]
+                    cp_path = os.path.join(ups_path, path)
+                    manifest = self._upstream_manifest(cp_path, component)
+                    # Listed once and shared by the checks and the sync
+                    index = self._index_entries(repo)
+                    if (manifest is not None and self._upstream_unchanged(
+                            repo, manifest, ups_path, index)):
+                        self.logger.info("No upstream changes in: " + component)
+                        self._record_state(image, repo, ups_path)
+                    else:
+                        self._pull(image, repo, ups_path, manifest, index, release)
 
                 self._check_labels(df_path)
         finally:
             # Cleanup upstream repos
             shutil.rmtree("upstreams", ignore_errors=True)
+            self._blobs.clear()
+
+    def _pull(self, image, repo, ups_path, manifest, index, release):
+        """Synchronizes a downstream repository with its upstream and commits
+
+        The state of the pull is recorded unless changes are left uncommitted.
+        """
+        component = image["component"]
+        df_path = os.path.join(component, "Dockerfile")
+        changed, removed = self._pull_upstream(component, image["git_path"], ups_path,
+                                               repo, manifest=manifest, index=index)
+        self.update_dockerfile(df_path, release, self.base_image)
+        self._stage(repo, changed + ["Dockerfile"], removed)
+        # It is possible for the git repository to have no changes
+        if self._has_staged_changes(repo):
+            commit = self.get_commit_msg(False, image)
+            if not commit:
+                msg = "Not creating new commit in: "
+                self.logger.info(msg + component)
+                # Pulled again in the next run
+                return
+            repo.git.commit("-m", commit)
+        self._record_state(image, repo, ups_path)
+
+    def _record_state(self, image, repo, ups_path):
+        """Records the inputs of a finished upstream pull
+
+        The downstream head queried by _changed_images is recorded, so the
+        next run compares with what it saw, even if the clone is not fetched.
+        """
+        downstream = self._down_heads.get(image["component"])
+        if downstream is None:
+            branch = "refs/remotes/origin/" + image["git_branch"]
+            downstream = self._ref_commit(repo, branch)
+        if downstream is None:
+            # Nothing to compare with in the next run
+            return
+        upstream = self._ref_commit(Repo(ups_path), "HEAD")
+        self.state.record(image["component"], upstream, downstream,
+                          self._config_hash(image))
+
+    def _config_hash(self, image):
+        return config_hash(image, self.conf.ignore_files, self.df_ext)
+
+    @staticmethod
+    def _ref_commit(repo, ref):
+        """Returns the commit hash ref points to, None if it does not exist
 
-    def _clone_upstream(self, url, ups_path, commands=None):
+        Only reads the references, without starting any git process.
+        """
         try:
-            repo = Repo.clone_from(url=url, to_path=ups_path)
-            self.logger.info("Cloned into: " + url)
-            for submodule in repo.submodules:
-                submodule.update(init=True)
-            self.logger.debug("Running commands in upstream repo.")
-            # Need to be in the upstream git root, so change cwd
-            oldcwd = os.getcwd()
-            os.chdir(ups_path)
-            for order in sorted(commands):
-                cmd = commands[order]
-                self.logger.debug("Running '{o}' command '{c}'".format(o=order,
-                                                                       c=cmd))
-                ret = subprocess.run(cmd.split(), stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-                if ret.returncode != 0:
-                    msg = "'{c}' failed".format(c=cmd.split(" "))
-                    self.logger.error(ret.stderr)
-                    raise RebuilderError(msg)
-            os.chdir(oldcwd)
-        except GitCommandError:
-            # Generally the directory already exists, try to open as a repo instead
+            return SymbolicReference.dereference_recursive(repo, ref)
+        except ValueError:
+            return None
+
+    def _remote_head(self, url, ref=None):
+        """Returns the commit a ref points to in a remote repository
+
+        Args:
+            url (str): URL of the repository or name of a remote
+            ref (str, optional): Branch, tag or commit, HEAD if not set
+
+        Returns:
+            str: Commit hash, None if it could not be found
+        """
+        if ref and re.match(r'^[0-9a-f]{40}$', ref):
+            return ref
+        try:
+            out = Git().ls_remote(url, ref or "HEAD")
+        except GitCommandError as e:
+            self.logger.warning("Could not query {}: {}".format(url, e))
+            return None
+        commit = None
+        for line in out.splitlines():
+            sha, name = line.split("\t")
+            # Annotated tags are peeled to the commit they point to
+            if name.endswith("^{}"):
+                return sha
+            commit = commit or sha
+        return commit
+
+    def _changed_images(self, images):
+        """Filters out images which do not need to be pulled again
+
+        Upstream and downstream heads are queried without cloning,
+        all repositories at once. Only images pulled before, whose downstream
+        repository is in the working directory, can be skipped.
+
+        Args:
+            images (list of dict): Images to check
+
+        Returns:
+            list of dict: Images with changed or unknown inputs
+        """
+        def downstream_head(image):
+            branch = "refs/heads/" + image["git_branch"]
+            try:
+                out = Repo(image["component"]).git.ls_remote("origin", branch)
+            except GitCommandError as e:
+                self.logger.warning("{}: {}".format(image["component"], e))
+                return None
+            return out.split("\t")[0] or None
+
+        # Only images pulled before can be unchanged
+        known = [i for i in images if i.get("pull_upstream", True)
+                 and os.path.isdir(i["component"])]
+        # Every upstream is queried once, even if shared by several images
+        refs = sorted(set((i["git_url"], i.get("git_ref") or "") for i in known))
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            ups_heads = dict(zip(refs, executor.map(lambda r: self._remote_head(*r), refs)))
+            down_heads = dict(zip((i["component"] for i in known),
+                                  executor.map(downstream_head, known)))
+        self._down_heads.update((c, h) for c, h in down_heads.items() if h)
+        results = [(ups_heads.get((i["git_url"], i.get("git_ref") or "")),
+                    down_heads.get(i["component"])) for i in images]
+        changed = []
+        for image, (upstream, downstream) in zip(images, results):
+            component = image["component"]
+            if self.state.is_current(component, upstream, downstream,
+                                     self._config_hash(image)):
+                self.logger.info("Unchanged since the last pull: " + component)
+            else:
+                changed.append(image)
+        msg = "Images with changed upstream or downstream: {}/{}"
+        self.logger.info(msg.format(len(changed), len(images)))
+        return changed
+
+    @staticmethod
+    def _upstream_key(image):
+        """Returns what identifies the upstream checkout used by an image"""
+        commands = tuple(sorted(image["commands"].items()))
+        strategy = image.get("clone_strategy", "full")
+        return image["git_url"], image.get("git_ref"), commands, strategy
+
+    def prepare_upstreams(self, images, workdir):
+        """Clones the upstream repositories used by images
+
+        Images using the same repository, revision, commands and clone
+        strategy share a single clone, so every repository is cloned and has
+        its commands run only once. Sparse clones check out the paths of all
+        images sharing them. Clones are named after the unversioned image name.
+        Up to self.jobs repositories are cloned and processed at once.
+
+        Args:
+            images (list of dict): Images to clone upstream repositories for
+            workdir (str): Directory to clone the repositories into
+
+        Returns:
+            dict: Path to the upstream clone of every component
+        """
+        groups = {}
+        for image in images:
+            groups.setdefault(self._upstream_key(image), []).append(image)
+        names = set()
+        paths = {}
+        for group in groups.values():
+            ups_name = group[0]["name"].split('-')[0]
+            name, n = ups_name, 1
+            # Different checkouts of the same repo need different names
+            while name in names:
+                n += 1
+                name = "{}-{}".format(ups_name, n)
+            names.add(name)
+            ups_path = os.path.join(workdir, name)
+            for image in group:
+                paths[image["component"]] = ups_path
+            if len(group) > 1:
+                msg = "Upstream clone {} shared by: {}"
+                components = ", ".join(i["component"] for i in group)
+                self.logger.debug(msg.format(ups_path, components))
+
+        def clone(key):
+            url, ref, commands, strategy = key
+            group = groups[key]
+            sparse = sorted(set(i["git_path"] for i in group))
+            self._clone_upstream(url, paths[group[0]["component"]],
+                                 commands=group[0]["commands"], ref=ref,
+                                 strategy=strategy, paths=sparse)
+
+        # Clones and commands of different repositories run concurrently
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(clone, groups))
+        return paths
+
+    def _clone_upstream(self, url, ups_path, commands=None, ref=None,
+                        strategy="full", paths=None):
+        """Clones an upstream repository and runs commands in it
+
+        Args:
+            url (str): URL of the upstream repository
+            ups_path (str): Path to clone the repository into
+            commands (dict, optional): Commands to run in the clone, by order
+            ref (str, optional): Branch, tag or commit to check out
+            strategy (str, optional): One of CLONE_STRATEGIES
+            paths (list of str, optional): Paths needed from the repository,
+                                           used by the sparse strategy
+
+        Returns:
+            git.Repo: The cloned repository
+        """
+        if strategy not in CLONE_STRATEGIES:
+            msg = "Unknown clone strategy '{}', expected one of: {}"
+            raise RebuilderError(msg.format(strategy, ", ".join(CLONE_STRATEGIES)))
+        if os.path.exists(ups_path):
+            # The repository has already been cloned, open it instead
             # Throws InvalidGitRepositoryError if it is not a git repo
             repo = Repo(ups_path)
             self.logger.info("Using existing repository.")
+            return repo
+        if strategy == "full":
+            # Only new objects are fetched into the local mirror of the upstream
+            repo = self.mirrors.clone(url, ups_path)
+            if ref:
+                repo.git.checkout(ref)
+            self._update_submodules(repo)
+        else:
+            sparse = paths if strategy == "sparse" else None
+            repo = self._clone_partial(url, ups_path, ref, sparse)
+        self.logger.info("Cloned into: " + url)
+        if commands:
+            # Partial checkouts may produce different results
+            extra = (strategy, sorted(paths or [])) if strategy == "sparse" else ()
+            self._run_commands(repo, commands, *extra)
         return repo
 
-    def _copy_upstream2downstream(self, src_parent, dest_parent):
-        """Copies content from upstream repo to downstream repo
+    def _run_commands(self, repo, commands, *extra):
+        """Runs commands in an upstream repository
 
-        Copies all files/dirs/symlinks from upstream source to dist-git one by one,
-        while removing previous if exists.
+        The changes made by the commands are cached by the upstream commit,
+        a clone of an already processed commit gets them restored instead.
 
         Args:
-            src_parent (string): path to source directory
-            dest_parent (string): path to destination directory
-        """
-        for f in os.listdir(src_parent):
-            dest = os.path.join(dest_parent, f)
-            src = os.path.join(src_parent, f)
-            # First remove the dest
-            if os.path.isdir(dest):
-                self.logger.debug("rmtree {}".format(dest))
-                shutil.rmtree(dest)
-            else:
-                u._remove_file(dest, self.logger)
+            repo (git.Repo): Upstream repository
+            commands (dict): Commands by the order they are run in
+            extra: Anything else the result of the commands depends on
+        """
+        key = self.snapshots.key(self._ref_commit(repo, "HEAD"), commands, *extra)
+        if self.snapshots.restore(repo, key):
+            msg = "Restored output of commands in {} from cache."
+            self.logger.info(msg.format(repo.working_tree_dir))
+            return
+        self.logger.debug("Running commands in upstream repo.")
+        for order in sorted(commands):
+            cmd = commands[order]
+            self.logger.debug("Running '{o}' command '{c}'".format(o=order,
+                                                                   c=cmd))
+            # Need to be in the upstream git root
+            ret = subprocess.run(cmd.split(), stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, cwd=repo.working_tree_dir)
+            if ret.returncode != 0:
+                msg = "'{c}' failed".format(c=cmd.split(" "))
+                self.logger.error(ret.stderr)
+                raise RebuilderError(msg)
+        self.snapshots.save(repo, key)
 
-            # Now copy the src to dest
-            if os.path.islink(src) or not os.path.isdir(src):
-                self.logger.debug("cp {} {}".format(src, dest))
-                shutil.copy2(src, dest, follow_symlinks=False)
-            else:
-                self.logger.debug("cp -r {} {}".format(src, dest))
-                shutil.copytree(src, dest, symlinks=True)
+    def _clone_partial(self, url, ups_path, ref=None, paths=None):
+        """Clones only the latest commit of an upstream repository
+
+        File contents are only fetched for the files being checked out.
+        If paths are given, only they and the targets of relative symlinks
+        found in them are checked out.
+        """
+        repo = Repo.clone_from(url=url, to_path=ups_path, depth=1,
+                               filter="blob:none", no_checkout=True)
+        if ref:
+            repo.git.fetch("--depth", "1", "origin", ref)
+            ref = "FETCH_HEAD"
+        else:
+            ref = repo.active_branch.name
+        if paths is None:
+            repo.git.checkout(ref)
+            self._update_submodules(repo)
+            return repo
+        patterns = set("/" + p.strip("/") for p in paths)
+        repo.git.sparse_checkout("set", "--no-cone", *sorted(patterns))
+        repo.git.checkout(ref)
+        # Symlinks may point to paths outside of the checked out ones,
+        # add their targets until nothing is missing
+        while True:
+            self._update_sparse_submodules(repo, patterns)
+            missing = set()
+            for target in self._missing_link_targets(ups_path):
+                # Submodules can only be checked out as a whole
+                for submodule in repo.submodules:
+                    if (target + "/").startswith(submodule.path + "/"):
+                        target = submodule.path
+                missing.add("/" + target)
+            missing -= patterns
+            if not missing:
+                break
+            self.logger.debug("Adding symlink targets: " + ", ".join(sorted(missing)))
+            patterns |= missing
+            repo.git.sparse_checkout("set", "--no-cone", *sorted(patterns))
+        return repo
 
-    def _handle_dangling_symlinks(self, src_parent, dest_parent):
-        """Replaces dangling symlinks in destination path with correct content
+    def _update_submodule(self, repo, submodule):
+        """Checks out a submodule using the local mirror of its repository
 
-        We need to remove downstream's (destination) dangling symlinks here,
-        because of files shared for more versions (s2i, root-common, test)
-        in upstream (source).
-        We do it by following first sources's symlink (not all symlinks) and
-        copying rest of the target to the destination.
+        Submodules shared by several upstreams are fetched into their mirror
+        only once per run, the checkouts borrow objects from the mirror.
+        """
+        repo.git.submodule("init", "--", submodule.path)
+        # Relative URLs are resolved by the initialization
+        url = repo.git.config("submodule.{}.url".format(submodule.name))
+        mirror = self.mirrors.update(url)
+        repo.git.submodule("update", "--reference", os.path.abspath(mirror),
+                           "--", submodule.path)
 
-        Args:
-            src_parent (string): path to source directory
-            dest_parent (string): path to destination directory
-        """
-        for dest_root, dest_dirs, dest_files in os.walk(dest_parent):
-            for dest_file_name in dest_files:
-                dest_file = os.path.join(dest_root, dest_file_name)
-                # Look for danging symlinks to relative path, then copy the content
-                # from source, following the first symlink
-                if os.path.islink(dest_file) and not os.path.isabs(os.readlink(dest_file)):
-                    dest_target = os.path.join(os.path.dirname(dest_file), os.readlink(dest_file))
-                    self.logger.debug('looking for dangling symlink {} (that points to {})'.format(dest_file, dest_target))
-                    if os.path.exists(dest_target):
-                        continue
-                    # We found a dangling symlink to relative path, so we need to use the matching path in source,
-                    # which means removing destination name from destination and adding it to source root
-                    dest_path_rel = re.sub(r"^{comp}{sep}".format(comp=dest_parent, sep=os.path.sep), "", dest_file)
-                    src_path_content = os.path.join(src_parent, dest_path_rel)
-                    self.logger.debug("unlink {dest}".format(dest=dest_file))
-                    os.unlink(dest_file)
-                    src_full = os.path.join(os.path.dirname(src_path_content), os.readlink(src_path_content))
-                    if os.path.isdir(src_full):
-                        # In this case, when the source directory includes another symlinks outside
-                        # of this directory, those wouldn't be fixed, so let's run the same function
-                        # to fix dangling symlinks recursively.
-                        self.logger.debug("cp -r {src} {dest}".format(src=src_full, dest=dest_file))
-                        shutil.copytree(src_full, dest_file, symlinks=True)
-                        self._handle_dangling_symlinks(src_parent, dest_parent)
-                    else:
-                        self.logger.debug("cp {src} {dest}".format(src=src_full, dest=dest_file))
-                        shutil.copy2(src_full, dest_file, follow_symlinks=False)
+    def _update_submodules(self, repo):
+        """Checks out all submodules of repo, see _update_submodule"""
+        if not os.path.isfile(os.path.join(repo.working_tree_dir, ".gitmodules")):
+            return
+        for submodule in repo.submodules:
+            self._update_submodule(repo, submodule)
 
-    def _pull_upstream(self, component, path, url, repo, ups_name, commands):
-        """Pulls an upstream repo and copies it into downstream"""
-        ups_path = os.path.join('upstreams/', ups_name)
-        cp_path = os.path.join(ups_path, path)
+    def _update_sparse_submodules(self, repo, patterns):
+        """Checks out submodules included in the sparse checkout patterns"""
+        included = [p.strip("/") for p in patterns]
+        for submodule in repo.submodules:
+            path = submodule.path + "/"
+            if any(not p or path.startswith(p + "/") for p in included):
+                if not os.path.exists(os.path.join(submodule.abspath, ".git")):
+                    self._update_submodule(repo, submodule)
+
+    @staticmethod
+    def _missing_link_targets(root):
+        """Returns the paths of missing targets of relative symlinks in root
+
+        Returns:
+            set of str: Paths relative to root, targets outside of it are left out
+        """
+        missing = set()
+        for dirpath, dirnames, filenames in os.walk(root):
+            if ".git" in dirnames:
+                dirnames.remove(".git")
+            # Dangling symlinks are always listed among the files
+            for name in filenames:
+                link = os.path.join(dirpath, name)
+                if not os.path.islink(link) or os.path.exists(link):
+                    continue
+                target = os.readlink(link)
+                if os.path.isabs(target):
+                    continue
+                target = os.path.normpath(os.path.join(dirpath, target))
+                target = os.path.relpath(target, root)
+                if not target.startswith(os.pardir):
+                    missing.add(target)
+        return missing
+
+    def _upstream_manifest(self, cp_path, component=None):
+        """Describes what the downstream repo should contain after a pull
+
+        Args:
+            cp_path (str): Path to the upstream content
+            component (str, optional): Path to the downstream repository,
+                                       the current directory if not set
 
-        for f in repo.git.ls_files().split('\n'):
-            os.remove(os.path.join(component, f))
-        self._clone_upstream(url, ups_path, commands=commands)
+        Returns:
+            dict: Manifest (see sync.build_manifest), None if there is
+                  no upstream content
+        """
         # First check if there is a version upstream
         # If not we just skip the whole copy action
         if not os.path.exists(cp_path):
             msg = "Source {} does not exist, skipping copy upstream."
             self.logger.warning(msg.format(cp_path))
-            return
-
-        # No need for upstream .git files so we remove them
-        shutil.rmtree(os.path.join(ups_path, path, '.git'), ignore_errors=True)
-        self._copy_upstream2downstream(cp_path, component)
-        self._handle_dangling_symlinks(cp_path, component)
+            return None
+        manifest = sync.build_manifest(cp_path, component or os.curdir,
+                                       self.logger)
         # If README.md exists but help.md does not, create a symlink
-        help_md = os.path.join(component, "help.md")
-        readme_md = os.path.join(component, "README.md")
-        if not os.path.isfile(help_md):
-            if os.path.isfile(readme_md):
-                os.symlink('README.md', help_md)
-                repo.git.add('help.md')
+        if not self._is_file(manifest, "help.md"):
+            if self._is_file(manifest, "README.md"):
+                manifest["help.md"] = (sync.LINK, "README.md")
             else:
                 # Report warning if help.md does not exists
                 self.logger.warn("help.md file missing")
-        # Add all the changes and remove those we do not want
-        repo.git.add("*")
-        self._do_git_reset(repo)
         # TODO: Configurable?
-        df_ext = self.df_ext
-        df_path = os.path.join(component, "Dockerfile")
-        if os.path.isfile(df_path + df_ext) and not os.path.islink(df_path + df_ext):
-            try:
-                os.remove(df_path)
-            except FileNotFoundError:
-                # We don't care whether CentOS dockerfile exists or not. Just don't fail here.
-                pass
-            repo.git.mv("Dockerfile" + df_ext, "Dockerfile")
-            os.symlink("Dockerfile", df_path + df_ext)
-            repo.git.add("Dockerfile", "Dockerfile" + df_ext)
+        df_ext = "Dockerfile" + self.df_ext
+        if manifest.get(df_ext, (None,))[0] == sync.FILE:
+            manifest["Dockerfile"] = manifest[df_ext]
+            manifest[df_ext] = (sync.LINK, "Dockerfile")
+        return manifest
+
+    @staticmethod
+    def _clean_blobs(path):
+        """Returns git modes and hashes of clean files tracked in repository path
+
+        Returns:
+            dict: Maps normalized file paths to (mode, object hash) tuples
+        """
+        repo = Repo(path)
+        blobs = {}
+        for line in repo.git.ls_files("-s", "-z").split("\0"):
+            if not line:
+                continue
+            info, rel = line.split("\t", 1)
+            mode, sha, stage = info.split()
+            blobs[os.path.normpath(os.path.join(path, rel))] = (mode, sha)
+        # Changed files have to be hashed again
+        for rel in repo.git.diff_files("--name-only", "-z").split("\0"):
+            blobs.pop(os.path.normpath(os.path.join(path, rel)), None)
+        return blobs
+
+    def _upstream_blobs(self, ups_path):
+        """Returns git modes and hashes of clean files tracked upstream
+
+        The result is kept until the end of the pull, see _clean_blobs.
+        """
+        if ups_path not in self._blobs:
+            self._blobs[ups_path] = self._clean_blobs(ups_path)
+        return self._blobs[ups_path]
+
+    @staticmethod
+    def _index_entries(repo):
+        """Lists the git index of a repository
+
+        Returns:
+            dict: Maps paths to (mode, object hash) tuples
+        """
+        entries = {}
+        for line in repo.git.ls_files("-s", "-z").split("\0"):
+            if line:
+                info, rel = line.split("\t", 1)
+                mode, sha, stage = info.split()
+                entries[rel] = (mode, sha)
+        return entries
+
+    def _stage(self, repo, paths, removed=()):
+        """Stages additions, changes and removals of paths at once
+
+        Paths ignored by .gitignore files are left out, unless tracked.
+        Removed paths are dropped from the index first, so that a path
+        may change between a file, a directory and a symlink.
+
+        Args:
+            repo (git.Repo): Repository to stage the paths in
+            paths (list of str): Paths that were added, changed or removed
+            removed (list of str, optional): Paths known to be removed
+        """
+        cwd = repo.working_tree_dir
+        removed = [p for p in removed if p]
+        if removed:
+            # Removed paths may now lie beyond a symlink, do not look at them
+            data = "".join(p + "\0" for p in removed)
+            subprocess.run(["git", "update-index", "--force-remove", "-z", "--stdin"],
+                           cwd=cwd, input=data.encode(), check=True)
+        paths = [p for p in paths if p and p not in removed]
+        if not paths:
+            return
+        data = "".join(p + "\0" for p in paths)
+        # check-ignore exits with 1 when no path is ignored
+        ret = subprocess.run(["git", "check-ignore", "-z", "--stdin"], cwd=cwd,
+                             input=data.encode(), stdout=subprocess.PIPE)
+        ignored = set(ret.stdout.decode().split("\0"))
+        data = "".join(p + "\0" for p in paths if p not in ignored)
+        # Entries in the way of a changed path (a directory replaced by
+        # a file or the other way round) are replaced
+        subprocess.run(["git", "update-index", "--add", "--remove", "--replace", "-z",
+                        "--stdin"], cwd=cwd, input=data.encode(), check=True)
+
+    @staticmethod
+    def _has_staged_changes(repo):
+        """Checks if the index of repo differs from its HEAD"""
+        status = repo.git.diff("--cached", "--quiet", with_extended_output=True,
+                               with_exceptions=False)[0]
+        return status != 0
+
+    def _upstream_unchanged(self, repo, manifest, ups_path, index=None):
+        """Checks if pulling upstream would leave downstream as it is
+
+        Compares the hash of the git tree downstream would have after
+        the pull with the tree of its HEAD, without touching any files.
+
+        Args:
+            repo (git.Repo): Downstream repository
+            manifest (dict): Manifest of the upstream content
+            ups_path (str): Path to the upstream clone
+            index (dict, optional): Index of repo, see _index_entries
+
+        Returns:
+            bool: True if the pull would not change anything
+        """
+        try:
+            head = repo.git.rev_parse("HEAD^{tree}")
+        except GitCommandError:
+            # Empty repository
+            return False
+        index = index if index is not None else self._index_entries(repo)
+        protected = ['.gitignore'] + self.conf.ignore_files
+        entries = sync.git_entries(manifest, self._upstream_blobs(ups_path))
+        # Ignored files are kept at their downstream versions
+        for rel in protected:
+            entries.pop(rel, None)
+            if rel in index:
+                entries[rel] = index[rel]
+        return sync.tree_hash(entries) == head
+
+    def _pull_upstream(self, component, path, ups_path, repo, manifest=None,
+                       index=None):
+        """Synchronizes downstream with an already cloned upstream repo
+
+        Only files that differ are written, files tracked downstream
+        but missing upstream are removed. The .gitignore and ignore_files
+        are always kept at their downstream versions.
+
+        Args:
+            manifest (dict, optional): Manifest of the upstream content,
+                                       created if not provided
+            index (dict, optional): Index of repo, see _index_entries
+
+        Returns:
+            tuple: Lists of changed and removed paths, to be staged
+        """
+        cp_path = os.path.join(ups_path, path)
+        if manifest is None:
+            manifest = self._upstream_manifest(cp_path, component)
+            if manifest is None:
+                return [], []
+        index = index if index is not None else self._index_entries(repo)
+        protected = ['.gitignore'] + self.conf.ignore_files
+        changed, removed = sync.sync_tree(manifest, component, index,
+                                          protected, self.logger)
+        msg = "{}: {} files updated, {} removed"
+        self.logger.debug(msg.format(component, len(changed), len(removed)))
         # Run post upstream pull hook
         self._post_upstream_pull(cp_path, component)
+        return changed, removed
+
+    @staticmethod
+    def _is_file(manifest, rel):
+        """Checks if rel is a file in the manifest, following symlinks"""
+        resolved = sync.resolve(manifest, rel)
+        return resolved is not None and manifest[resolved][0] == sync.FILE
 
     def _post_upstream_pull(sefl, upstream_path, downstream_path):
         """Post upstream pull hook"""
         pass
 
-    def _clone_downstream(self, component, branch):
-        """Clones downstream dist-git repo"""
+    def _clone_downstream(self, component, branch, workdir=None):
+        """Clones downstream dist-git repo
+
+        Args:
+            component (str): Name of the dist-git repository
+            branch (str): Branch to be checked out
+            workdir (str, optional): Directory to clone the repository into,
+                                     the current directory is used if not set
+        """
+        workdir = workdir if workdir else os.getcwd()
+        path = os.path.join(workdir, component)
         # Do not set up downstream repo if it already exists
-        if os.path.isdir(component):
+        if os.path.isdir(path):
             self.logger.info("Using existing downstream repo: " + component)
-            repo = Repo(component)
+            repo = Repo(path)
+            if self.workdirs.clone_state(path) == {"branch": branch}:
+                return repo
+            # The repo may be the leftover of an interrupted clone
+            if not repo.head.is_valid():
+                msg = "Incomplete clone of {} found in {}, remove it or clear the cache."
+                raise RebuilderError(msg.format(component, workdir))
         else:
+            self.workdirs.forget_clone(path)
             ccomponent = "container/" + component
             self.logger.info("Cloning into: " + ccomponent)
             packager = u._get_packager(self.conf)
             ret = subprocess.run([packager, "clone", ccomponent],
                                  stdout=subprocess.DEVNULL,
-                                 stderr=subprocess.DEVNULL)
+                                 stderr=subprocess.DEVNULL, cwd=workdir)
             # If the clone failed, try once again with the containers prefix
             if ret.returncode != 0:
                 ccomponent = "containers/" + component
                 ret = subprocess.run([packager, "clone", ccomponent],
                                      stdout=subprocess.DEVNULL,
-                                     stderr=subprocess.DEVNULL)
+                                     stderr=subprocess.DEVNULL, cwd=workdir)
                 if ret.returncode != 0:
                     template = "{} failed to clone {} with return value {}."
                     raise RebuilderError(template.format(packager, component,
                                                          ret.returncode))
-            repo = Repo(component)
+            repo = Repo(path)
             repo.git.checkout(branch)
+        self.workdirs.record_clone(path, branch)
         return repo
 
-    def push_changes(self, tmp, images):
-        """Pushes changes for components into downstream dist-git repository"""
-        # Check for kerberos ticket
-        failed = []
-        for image in images:
-            component = image["component"]
+    def clone_downstreams(self, images, workdir):
+        """Clones downstream dist-git repos of several images in parallel
+
+        Up to self.jobs repositories are cloned at once, failures are
+        reported per image and summarized at the end.
+
+        Args:
+            images (list of dict): Images to clone the repositories for
+            workdir (str): Directory to clone the repositories into
+
+        Returns:
+            dict: Repo objects of the successfully cloned components
+        """
+        def clone(image):
             try:
-                repo = Repo(component)
-                self.logger.info("Pushing: " + component)
-                # If a commit message is provided do a commit first
-                if self.commit_msg and repo.is_dirty():
-                    # commit_msg is set so it is always returned
-                    commit = self.get_commit_msg(None, image)
-                    repo.git.commit("-am", commit)
-                repo.git.push()
-            except GitCommandError as e:
-                failed.append(image)
-                self.logger.error(e)
+                repo = self._clone_downstream(image["component"],
+                                              image["git_branch"], workdir)
+                return image, repo, None
+            except (RebuilderError, GitCommandError) as e:
+                return image, None, e
 
+        repos = {}
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for image, repo, error in executor.map(clone, images):
+                if error is not None:
+                    self.logger.error("{}: {}".format(image["component"], error))
+                    failed.append(image)
+                else:
+                    repos[image["component"]] = repo
+        self.logger.info("Downstream repositories ready: {}/{}".format(len(repos),
+                                                                      len(images)))
         if failed:
-            self.logger.error("Failed pushing images:")
+            self.logger.error("Failed cloning images:")
             for image in failed:
                 self.logger.error(u._2sp(image["component"]))
+        return repos
+
+    def _git_push(self, path):
+        """Runs git push in path, killing it after push_timeout seconds
+
+        The push runs in a process group of its own, so that helpers it
+        starts (ssh, remote hooks of local remotes) are killed with it.
+        """
+        command = ["git", "push"]
+        proc = subprocess.Popen(command, cwd=path, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, start_new_session=True)
+        try:
+            _, err = proc.communicate(timeout=self.push_timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            msg = "Timeout: the command \"git push\" did not complete in {} secs."
+            raise GitCommandError(command, -signal.SIGKILL,
+                                  msg.format(self.push_timeout))
+        if proc.returncode != 0:
+            raise GitCommandError(command, proc.returncode,
+                                  err.decode('utf-8', errors='replace'))
+
+    def _push(self, image, path):
+        """Commits and pushes changes of a single component
+
+        Pushes taking longer than push_timeout are killed, pushes failing
+        on transient errors are retried up to push_retries times with
+        an exponential backoff.
+
+        Returns:
+            PushResult: Outcome of the push
+        """
+        component = image["component"]
+        start = time.time()
+        attempts = 0
+        try:
+            repo = Repo(path)
+            # If a commit message is provided do a commit first
+            if self.commit_msg and repo.is_dirty():
+                # commit_msg is set so it is always returned
+                commit = self.get_commit_msg(None, image)
+                repo.git.commit("-am", commit)
+            while True:
+                attempts += 1
+                self.logger.info("Pushing: " + component)
+                try:
+                    self._git_push(path)
+                    return PushResult(component, "pushed", attempts,
+                                      time.time() - start, None)
+                except GitCommandError as e:
+                    error = str(e)
+                    transient = any(t in error for t in TRANSIENT_ERRORS)
+                    if not transient or attempts > self.push_retries:
+                        raise
+                    delay = PUSH_BACKOFF * 2 ** (attempts - 1)
+                    self.logger.debug(error)
+                    msg = "Retrying push of {} in {}s"
+                    self.logger.warning(msg.format(component, delay))
+                    time.sleep(delay)
+        except GitCommandError as e:
+            status = "timeout" if "Timeout:" in str(e) else "failed"
+            self.logger.error(e)
+            return PushResult(component, status, attempts, time.time() - start, e)
+
+    def push_changes(self, tmp, images):
+        """Pushes changes for components into downstream dist-git repository
+
+        Repositories are pushed concurrently, see _push.
+
+        Returns:
+            list: PushResult of every image, in the order of images
+        """
+        # Check for kerberos ticket
+        paths = [os.path.abspath(image["component"]) for image in images]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(self._push, images, paths))
+
+        failed = [r for r in results if r.status != "pushed"]
+        pushed = len(results) - len(failed)
+        self.logger.info("Pushed repositories: {}/{}".format(pushed, len(results)))
+        if failed:
+            self.logger.error("Failed pushing images:")
+            for result in failed:
+                msg = "{} ({}, {} attempts)".format(result.component, result.status,
+                                                    result.attempts)
+                self.logger.error(u._2sp(msg))
             self.logger.error("Please check the failures and push the changes manually.")
+        return results
+
+    def _merge_future_branch(self, repo, branch, future):
+        """Merges branch into future in a separate worktree of repo
+
+        The primary working tree of repo is never touched, the local
+        future branch is created from origin if it does not exist yet.
+        A merge that fails is aborted, leaving the future branch as it was.
+        """
+        path = os.path.join(repo.git_dir, "cwt-worktrees", future)
+        # Clean up after a previous run that did not finish
+        if os.path.isdir(path):
+            repo.git.worktree("remove", "--force", path)
+        repo.git.worktree("prune")
+        if future in repo.heads:
+            repo.git.worktree("add", path, future)
+        else:
+            repo.git.worktree("add", "-b", future, path, "origin/" + future)
+        try:
+            Git(path).merge("--no-edit", branch)
+        except GitCommandError:
+            Git(path).merge("--abort", with_exceptions=False)
+            raise
+        finally:
+            repo.git.worktree("remove", "--force", path)
 
-    # TODO: Multiple future branches?
     def merge_future_branches(self, images):
-        """Merges current branch with future branches"""
+        """Merges current branch with future branches
+
+        Images are merged in parallel, each future branch in a worktree
+        of its own, see _merge_future_branch.
+        """
         # Check for kerberos ticket
-        failed = []
-        for image in images:
+        repos = self.clone_downstreams(images, os.getcwd())
+
+        def merge(image):
+            failed = []
             component = image["component"]
             branch = image["git_branch"]
-            # TODO: config only has one future branch
-            fb_list = [image["git_future"]]
-            repo = self._clone_downstream(component, branch)
-            for fb in fb_list:
+            for fb in image["git_futures"]:
+                if fb == branch:
+                    continue
                 try:
-                    repo.git.checkout(fb)
-                    repo.git.merge(branch)
+                    self._merge_future_branch(repos[component], branch, fb)
                     # print("Pushing into: {}".format(res))
                     self.logger.info("NOT Pushing into: {}".format(fb))
                     # repo.git.push()
                 except GitCommandError as e:
-                    failed.append(image)
+                    failed.append("{} ({})".format(component, fb))
                     self.logger.error(e)
-                    continue
+            return failed
+
+        failed = []
+        merged = [i for i in images if i["component"] in repos]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result in executor.map(merge, merged):
+                failed += result
         if failed:
             self.logger.error("Failed merging images:")
-            for image in failed:
-                self.logger.error(u._2sp(image["component"]))
+            for name in failed:
+                self.logger.error(u._2sp(name))
             self.logger.error("Please check the failures and push the changes manually.")
 
-    def show_git_changes(self, tmp, components=None, diff=False):
-        """Shows changes made to tracked files in local downstream repositories
-
-        Walks through all repositories and calls 'git-show' or 'git-diff' on each of them.
+    def _repo_paths(self, tmp, components=None):
+        """Returns paths of the local downstream repositories of components
 
         Args:
             tmp (str): Path to the directory that is used to store git repositories
-            components (list of str, optional): List of components to show changes for
-            diff (boolean, optional): Controls whether the method calls git-show or git-diff
+            components (list of str, optional): List of components, all repositories
+                                                found in tmp are used if not set
         """
         # Function to check if a path contains a git repository
         def is_git(x): return os.path.isdir(os.path.join(x, '.git'))
         files = None
-        command = 'diff' if diff else 'show'
         # Create a list of repository paths
         if not components:
             # Get the whole subdirectory
@@ -504,11 +1194,95 @@ class DistgitAPI(object):
             raise u.RebuilderError("Unknown component: {}".format(str(components)))
         if not files:
             self.logger.warn("No git repositories found in directory " + tmp)
+        return files
+
+    def show_git_changes(self, tmp, components=None, diff=False):
+        """Shows changes made to tracked files in local downstream repositories
+
+        Walks through all repositories and calls 'git-show' or 'git-diff' on each of them.
+
+        Args:
+            tmp (str): Path to the directory that is used to store git repositories
+            components (list of str, optional): List of components to show changes for
+            diff (boolean, optional): Controls whether the method calls git-show or git-diff
+        """
+        command = 'diff' if diff else 'show'
         # Walk through the repositories and show changes made in the last commit
-        for path in files:
+        for path in self._repo_paths(tmp, components):
             # Clears the screen
             print(chr(27) + "[2J")
             # Force pager for short git diffs
             subprocess.run("git config core.pager 'less -+F' --replace-all", cwd=path, shell=True)
             # Not using GitPython as its git.show seems to have some problems with encoding
             subprocess.run(['git', command], cwd=path)
+
+    @staticmethod
+    def _git_output(path, args, limit):
+        """Runs git in path and returns at most limit bytes of its output
+
+        Returns:
+            tuple: Decoded output and the number of bytes left out
+        """
+        proc = subprocess.Popen(['git', '--no-pager'] + args, cwd=path,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with proc.stdout:
+            output = proc.stdout.read(limit)
+            dropped = len(proc.stdout.read(1))
+            if dropped:
+                # The size of the rest is only counted, not kept
+                for chunk in iter(lambda: proc.stdout.read(65536), b""):
+                    dropped += len(chunk)
+        proc.wait()
+        return output.decode('utf-8', errors='replace'), dropped
+
+    def _change_entry(self, path, diff, limit):
+        """Collects the changes of a single repository for report_git_changes"""
+        revision = [] if diff else ['HEAD']
+        command = 'diff' if diff else 'show'
+        if diff:
+            subject = "Uncommitted changes"
+        else:
+            subject, _ = self._git_output(path, ['log', '-1', '--format=%h %s'], limit)
+        stat, _ = self._git_output(path, [command, '--no-color', '--stat', '--format=']
+                                   + revision, limit)
+        patch, dropped = self._git_output(path, [command, '--no-color', '--patch',
+                                                 '--format='] + revision, limit)
+        return {"component": os.path.basename(path), "subject": subject.strip(),
+                "stat": stat.strip("\n"), "patch": patch, "truncated": dropped}
+
+    def report_git_changes(self, tmp, components=None, diff=False, fmt="text",
+                           limit=REPORT_SIZE_LIMIT, out=None):
+        """Writes changes of local downstream repositories into a single report
+
+        A non-interactive alternative to show_git_changes, the repositories
+        are read concurrently and written out in order as they are ready.
+
+        Args:
+            tmp (str): Path to the directory that is used to store git repositories
+            components (list of str, optional): List of components to show changes for
+            diff (boolean, optional): Report uncommitted changes instead of the last commit
+            fmt (str, optional): Format of the report, text or json
+            limit (int, optional): Maximum size of the patch of a single repository in bytes
+            out (file, optional): Where the report is written, stdout by default
+        """
+        if fmt not in REPORT_FORMATS:
+            msg = "Unknown report format {}, use one of: {}"
+            raise RebuilderError(msg.format(fmt, ", ".join(REPORT_FORMATS)))
+        out = out if out else sys.stdout
+        paths = self._repo_paths(tmp, components)
+        if fmt == "json":
+            out.write("[")
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            entries = executor.map(lambda p: self._change_entry(p, diff, limit), paths)
+            for i, entry in enumerate(entries):
+                if fmt == "json":
+                    out.write(("," if i else "") + "\n" + json.dumps(entry))
+                    continue
+                out.write("=== {}: {}\n".format(entry["component"], entry["subject"]))
+                out.write(entry["stat"] + "\n\n" + entry["patch"])
+                if entry["truncated"]:
+                    out.write("\n[{} more bytes of the patch left out]\n".format(entry["truncated"]))
+                out.write("\n")
+                out.flush()
+        if fmt == "json":
+            out.write("\n]\n")
@@ -1,23 +1,268 @@
+import re
+import ssl
+import math
+import time
+import functools
+import threading
+import http.client
+import urllib.parse
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
 
 import container_workflow_tool.utility as u
+from container_workflow_tool.cache import DiskCache
+from container_workflow_tool.constants import KOJI_URL
+
+# Koji build state of a successfully finished build
+BUILD_COMPLETE = 1
+
+
+def rpmvercmp(a, b):
+    """Compares two version or release strings the same way rpm does
+
+    Returns:
+        int: 1 if a is newer, -1 if b is newer, 0 if they are equal
+    """
+    if a == b:
+        return 0
+    segments_a = re.findall(r'~|[0-9]+|[a-zA-Z]+', a)
+    segments_b = re.findall(r'~|[0-9]+|[a-zA-Z]+', b)
+    while segments_a or segments_b:
+        # A tilde sorts before anything else, even the end of the string
+        tilde_a = bool(segments_a) and segments_a[0] == '~'
+        tilde_b = bool(segments_b) and segments_b[0] == '~'
+        if tilde_a or tilde_b:
+            if not (tilde_a and tilde_b):
+                return -1 if tilde_a else 1
+            segments_a.pop(0)
+            segments_b.pop(0)
+            continue
+        if not segments_a or not segments_b:
+            return 1 if segments_a else -1
+        seg_a, seg_b = segments_a.pop(0), segments_b.pop(0)
+        if seg_a.isdigit() != seg_b.isdigit():
+            # Numeric segments are always newer than alphabetic ones
+            return 1 if seg_a.isdigit() else -1
+        if seg_a.isdigit():
+            seg_a, seg_b = int(seg_a), int(seg_b)
+        if seg_a != seg_b:
+            return 1 if seg_a > seg_b else -1
+    return 0
+
+
+def compare_builds(a, b):
+    """Compares two koji builds by their epoch, version and release"""
+    epoch_a, epoch_b = a.get('epoch') or 0, b.get('epoch') or 0
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+    return (rpmvercmp(a['version'], b['version'])
+            or rpmvercmp(a['release'], b['release']))
+
+
+class _TLSSessions(object):
+    """TLS context and the last session shared by all connections to a hub"""
+
+    def __init__(self):
+        self.context = ssl.create_default_context()
+        self.session = None
+        self.lock = threading.Lock()
+
+
+class _SessionHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection resuming the TLS session of earlier connections"""
+
+    def __init__(self, host, tls, **kwargs):
+        super(_SessionHTTPSConnection, self).__init__(host, context=tls.context,
+                                                      **kwargs)
+        self.tls = tls
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host if self._tunnel_host else self.host
+        with self.tls.lock:
+            session = self.tls.session
+        self.sock = self._context.wrap_socket(self.sock,
+                                              server_hostname=server_hostname,
+                                              session=session)
+        with self.tls.lock:
+            self.tls.session = self.sock.session
+
+
+class _KeepAliveTransport(xmlrpc.client.Transport):
+    """XML-RPC transport keeping a persistent connection to the hub
+
+    Responses are requested gzip-compressed. A transport is not
+    thread-safe, so every thread talking to the hub uses its own.
+    """
+
+    accept_gzip_encoding = True
+
+    def __init__(self, tls=None):
+        super(_KeepAliveTransport, self).__init__(use_builtin_types=False)
+        self.tls = tls
+        # Size of the last response as received from the hub
+        self.bytes_received = 0
+
+    def parse_response(self, response):
+        read = response.read
+
+        def counting_read(*args):
+            data = read(*args)
+            self.bytes_received += len(data)
+            return data
+        response.read = counting_read
+        return super(_KeepAliveTransport, self).parse_response(response)
+
+    def make_connection(self, host):
+        if self.tls is None:
+            return super(_KeepAliveTransport, self).make_connection(host)
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        self._connection = host, _SessionHTTPSConnection(chost, self.tls)
+        return self._connection[1]
+
+
+class KojiStats(object):
+    """Collects latency and volume data of calls made to the Koji hub"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.bytes = {}
+        self.cache = {}
+
+    def record(self, method, duration, size):
+        with self.lock:
+            self.durations.setdefault(method, []).append(duration)
+            self.bytes[method] = self.bytes.get(method, 0) + size
+
+    def record_cache(self, name, hit):
+        with self.lock:
+            hits, misses = self.cache.get(name, (0, 0))
+            self.cache[name] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+    @staticmethod
+    def _percentile(values, percent):
+        values = sorted(values)
+        return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+    def summary(self):
+        """Returns the collected data
+
+        Returns:
+            dict: Per method count, total, p50, p95 (in seconds) and bytes,
+                  cache hits and misses are listed under 'cache'
+        """
+        with self.lock:
+            methods = {}
+            for method, durations in self.durations.items():
+                methods[method] = {
+                    "count": len(durations),
+                    "total": sum(durations),
+                    "p50": self._percentile(durations, 50),
+                    "p95": self._percentile(durations, 95),
+                    "bytes": self.bytes[method],
+                }
+            cache = {name: {"hits": hits, "misses": misses}
+                     for name, (hits, misses) in self.cache.items()}
+        return {"methods": methods, "cache": cache}
+
+    def format(self):
+        """Returns the collected data as a printable table"""
+        summary = self.summary()
+        template = "{:<28} {:>6} {:>9} {:>9} {:>9} {:>11}"
+        lines = [template.format("Method", "Count", "Total[s]", "p50[s]",
+                                 "p95[s]", "Bytes")]
+        for method, data in sorted(summary["methods"].items()):
+            lines.append(template.format(method, data["count"],
+                                         "{:.3f}".format(data["total"]),
+                                         "{:.3f}".format(data["p50"]),
+                                         "{:.3f}".format(data["p95"]),
+                                         data["bytes"]))
+        for name, data in sorted(summary["cache"].items()):
+            lines.append("Cache {}: {} hits, {} misses".format(name, data["hits"],
+                                                             data["misses"]))
+        return '\n'.join(lines)
 
 
 class KojiAPI:
     """Class for working with Koji."""
 
-    def __init__(self, conf, logger, latest=False):
-        url = "https://koji.fedoraproject.org/kojihub"
-        self.brew = xmlrpc.client.ServerProxy(url, allow_none=True)
+    def __init__(self, conf, logger, latest=False, cache_path=None):
+        self.url = getattr(conf, "koji_url", KOJI_URL)
+        https = urllib.parse.urlsplit(self.url).scheme == "https"
+        self._tls = _TLSSessions() if https else None
+        # Every thread gets its own proxy with a persistent connection
+        self._local = threading.local()
+        self.workers = getattr(conf, "koji_workers", 4)
+        self.stats = KojiStats()
+        self._executor = None
         self.nvrs = []
         self.buildinfo = {}
         self.conf = conf
         self.logger = logger if logger else u.setup_logger("koji")
         self.logger.name = "koji"
         self.latest_by_nvr = latest
+        # Number of most recently tagged builds considered by latest_by_nvr
+        self.latest_candidates = getattr(conf, "koji_latest_candidates", 10)
+        self.batch_size = getattr(conf, "koji_batch_size", 50)
+        # Finished builds never change, only the latest builds of a tag do
+        self.cache = DiskCache(cache_path, table="koji")
+        self.cache_ttl = getattr(conf, "koji_cache_ttl", 600)
+
+    @property
+    def brew(self):
+        """XML-RPC proxy of the hub to be used by the current thread"""
+        proxy = getattr(self._local, 'proxy', None)
+        if proxy is None:
+            transport = _KeepAliveTransport(tls=self._tls)
+            proxy = xmlrpc.client.ServerProxy(self.url, transport=transport,
+                                              allow_none=True)
+            self._local.transport = transport
+            self._local.proxy = proxy
+        return proxy
+
+    def _call(self, method, *args, label=None):
+        """Calls a hub method and records its duration and response size
+
+        Args:
+            method (str): Name of the hub method
+            label (str, optional): Name the call is recorded under
+        """
+        proxy = self.brew
+        transport = self._local.transport
+        transport.bytes_received = 0
+        start = time.time()
+        try:
+            return getattr(proxy, method)(*args)
+        finally:
+            self.stats.record(label or method, time.time() - start,
+                              transport.bytes_received)
+
+    def get_stats(self):
+        """Returns latency and volume data of the hub calls made so far"""
+        return self.stats.summary()
+
+    def _map(self, func, items):
+        """Runs func for all items on the worker pool, keeps the order"""
+        if self.workers <= 1 or len(items) <= 1:
+            return [func(i) for i in items]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(self._executor.map(func, items))
 
     def clear_cache(self):
+        self.nvrs = []
         self.buildinfo = {}
+        self.cache.clear()
+
+    def _cache_buildinfo(self, nvr, buildinfo):
+        """Stores build info in memory and finished builds also on disk"""
+        self.buildinfo[nvr] = buildinfo
+        if buildinfo and buildinfo.get('state') == BUILD_COMPLETE:
+            self.cache.set('build:' + buildinfo['nvr'], buildinfo)
+            self.cache.set('build:' + str(buildinfo['build_id']), buildinfo)
 
     def get_time_built(self, nvr):
         """Gets time built from brew"""
@@ -32,40 +277,200 @@ class KojiAPI:
     def get_taskinfo(self, task_id):
         """Gets task info from brew"""
         self.logger.debug("Getting taskinfo for task " + str(task_id))
-        return self.brew.getTaskInfo(task_id)
+        return self._call('getTaskInfo', task_id)
 
     def get_buildinfo(self, nvr):
-        """Gets build info from brew"""
-        if nvr not in self.buildinfo:
-            self.logger.debug("Getting buildinfo for " + nvr)
-            self.buildinfo[nvr] = self.brew.getBuild(nvr)
-        else:
+        """Gets build info from brew
+
+        Args:
+            nvr (str or int): NVR or ID of the build
+        """
+        nvr = str(nvr)
+        if nvr in self.buildinfo:
             self.logger.debug("Buildinfo for {} found in cache".format(nvr))
+            self.stats.record_cache('buildinfo', True)
+            return self.buildinfo[nvr]
+        buildinfo = self.cache.get('build:' + nvr)
+        self.stats.record_cache('buildinfo', buildinfo is not None)
+        if buildinfo is not None:
+            self.logger.debug("Buildinfo for {} found in disk cache".format(nvr))
+            self.buildinfo[nvr] = buildinfo
+        else:
+            self.logger.debug("Getting buildinfo for " + nvr)
+            self._cache_buildinfo(nvr, self._call('getBuild', nvr))
         return self.buildinfo[nvr]
 
+    def get_archives(self, build_id):
+        """Gets the list of archives of a build from brew"""
+        key = 'archives:' + str(build_id)
+        archives = self.cache.get(key)
+        self.stats.record_cache('archives', archives is not None)
+        if archives is None:
+            self.logger.debug("Getting archives for build " + str(build_id))
+            archives = self._call('listArchives', build_id)
+            # Archives only show up once a build is finished and stay the same
+            if archives:
+                self.cache.set(key, archives)
+        return archives
+
+    def prefetch_builds(self, nvrs):
+        """Fetches build info and archives for several builds at once
+
+        Data missing from the caches is requested in batched multicalls,
+        so that get_buildinfo, get_archives and get_time_built can be
+        answered from the caches afterwards.
+
+        Args:
+            nvrs (list of str): NVRs of the builds
+        """
+        missing = []
+        for nvr in nvrs:
+            if nvr in self.buildinfo:
+                self.stats.record_cache('buildinfo', True)
+                continue
+            buildinfo = self.cache.get('build:' + nvr)
+            self.stats.record_cache('buildinfo', buildinfo is not None)
+            if buildinfo is not None:
+                self.buildinfo[nvr] = buildinfo
+            else:
+                missing.append(nvr)
+        if missing:
+            self.logger.debug("Getting buildinfo for {} builds".format(len(missing)))
+            calls = [('getBuild', (nvr,)) for nvr in missing]
+            for nvr, buildinfo in zip(missing, self._multicall(calls)):
+                if isinstance(buildinfo, xmlrpc.client.Fault):
+                    msg = "Failed to get buildinfo for {}: {}"
+                    self.logger.warn(msg.format(nvr, buildinfo.faultString))
+                    continue
+                self._cache_buildinfo(nvr, buildinfo)
+
+        build_ids = {self.buildinfo[nvr]['build_id'] for nvr in nvrs
+                     if self.buildinfo.get(nvr)}
+        missing = []
+        for build_id in sorted(build_ids):
+            cached = self.cache.get('archives:' + str(build_id)) is not None
+            self.stats.record_cache('archives', cached)
+            if not cached:
+                missing.append(build_id)
+        if missing:
+            self.logger.debug("Getting archives for {} builds".format(len(missing)))
+            calls = [('listArchives', (b,)) for b in missing]
+            for build_id, archives in zip(missing, self._multicall(calls)):
+                if isinstance(archives, xmlrpc.client.Fault):
+                    msg = "Failed to get archives for build {}: {}"
+                    self.logger.warn(msg.format(build_id, archives.faultString))
+                    continue
+                if archives:
+                    self.cache.set('archives:' + str(build_id), archives)
+
     def get_all_builds(self, component, tag):
-        return self.brew.listTagged(tag, None, None, None, None, component)
+        return self._call('listTagged', tag, None, None, None, None, component)
+
+    def _multicall(self, calls):
+        """Runs several hub calls using batched XML-RPC multicalls
+
+        Batches are sent concurrently using up to koji_workers threads.
+
+        Args:
+            calls (list of (str, tuple)): Method names and their arguments
+
+        Returns:
+            list: Results in the same order as calls, a failed call is
+                  represented by an xmlrpc.client.Fault instance
+        """
+        # Split the calls so that small sets still use all the workers
+        workers = max(1, self.workers)
+        batch_size = min(max(1, self.batch_size),
+                         max(1, math.ceil(len(calls) / workers)))
+        batches = [calls[start:start + batch_size]
+                   for start in range(0, len(calls), batch_size)]
+        results = []
+        for batch_results in self._map(self._send_multicall, batches):
+            results.extend(batch_results)
+        return results
+
+    def _send_multicall(self, batch):
+        """Sends a single multicall to the hub"""
+        self.logger.debug("Sending multicall with {} calls".format(len(batch)))
+        request = [{'methodName': method, 'params': list(args)}
+                   for method, args in batch]
+        results = []
+        methods = sorted({method for method, args in batch})
+        label = "multiCall({})".format(",".join(methods))
+        for res in self._call('multiCall', request, label=label):
+            if isinstance(res, dict):
+                res = xmlrpc.client.Fault(res.get('faultCode'),
+                                          res.get('faultString'))
+            else:
+                res = res[0]
+            results.append(res)
+        return results
+
+    def _latest_key(self, tag, component):
+        """Returns the cache key of the latest build of a component"""
+        mode = "release" if self.latest_by_nvr else "time"
+        return "latest:{}:{}:{}".format(mode, tag, component)
+
+    def _nvr_call(self, tag, component):
+        """Returns the hub call used for looking up the latest nvr"""
+        if self.latest_by_nvr:
+            # Let the hub return only the most recently tagged builds,
+            # the whole tag history is used if no limit is configured
+            latest = self.latest_candidates or None
+            return ('listTagged', (tag, None, None, None, latest, component))
+        return ('getLatestBuilds', (tag, None, component))
+
+    def _select_nvr(self, builds, tag, component):
+        """Picks the latest nvr from a list of builds returned by the hub"""
+        if self.latest_by_nvr:
+            # Use the latest build version and release-wise
+            builds = sorted(builds, key=functools.cmp_to_key(compare_builds),
+                            reverse=True)
+        nvr = builds[0]['nvr'] if builds else None
+        if nvr is None:
+            self.logger.warn("No build found for " + component + " using tag "
+                             + tag)
+        return nvr
 
     def get_nvrs(self, images):
         """Gets nvrs from brew
 
+        Look-ups for all images are sent in batched multicalls,
+        see koji_batch_size in the configuration.
+
         Returns:
-            list of (str, str, str, obj): Brew nvrs.
-                                          Format: (nvr, component, name, Bug)
+            list of (str, str, str): Brew nvrs.
+                                     Format: (nvr, name, component)
         """
         if not self.nvrs:
             images_num = len(images)
             nvr_list = []
             self.logger.info("Fetching info from Brew... (0/{})".format(images_num))
-            for i, image in enumerate(images, 1):
-                if i % 10 is 0:
-                    self.logger.info("Fetching info from Brew... ({}/{})".format(i, images_num))
-                name = image["name"]
+            latest = {}
+            for image in images:
+                key = self._latest_key(image["build_tag"], image["component"])
+                cached = self.cache.get(key, ttl=self.cache_ttl)
+                self.stats.record_cache('latest', cached is not None)
+                if cached is not None:
+                    latest[key] = cached["nvr"]
+            missing = [i for i in images
+                       if self._latest_key(i["build_tag"], i["component"]) not in latest]
+            calls = [self._nvr_call(i["build_tag"], i["component"]) for i in missing]
+            for image, builds in zip(missing, self._multicall(calls)):
                 component = image["component"]
                 tag = image["build_tag"]
-                nvr = self.get_nvr(tag, component)
-                list_item = (nvr, name, component)
-                nvr_list.append(list_item)
+                key = self._latest_key(tag, component)
+                if isinstance(builds, xmlrpc.client.Fault):
+                    msg = "Failed to get builds for {} using tag {}: {}"
+                    self.logger.warn(msg.format(component, tag,
+                                                builds.faultString))
+                    latest[key] = None
+                    continue
+                latest[key] = self._select_nvr(builds, tag, component)
+                self.cache.set(key, {"nvr": latest[key]})
+            for image in images:
+                key = self._latest_key(image["build_tag"], image["component"])
+                nvr_list.append((latest[key], image["name"], image["component"]))
             self.logger.info("Fetching info from Brew... ({n}/{n})".format(n=images_num))
             self.nvrs = nvr_list
 
@@ -74,18 +479,15 @@ class KojiAPI:
     def get_nvr(self, tag, component):
         msg = "Getting latest nvr for component {} with tag {}"
         self.logger.debug(msg.format(component, tag))
-        if self.latest_by_nvr:
-            # Lets get all the builds and use the latest (release-wise)
-            b = self.get_all_builds(component, tag)
-            builds = sorted(b, key=lambda x: float(x['release']), reverse=True)
-        else:
-            # Get latest by time built
-            builds = self.brew.getLatestBuilds(tag, None, component)
-
-        nvr = builds[0]['nvr'] if builds else None
-        if nvr is None:
-            self.logger.warn("No build found for " + component + " using tag "
-                             + tag)
+        key = self._latest_key(tag, component)
+        cached = self.cache.get(key, ttl=self.cache_ttl)
+        self.stats.record_cache('latest', cached is not None)
+        if cached is not None:
+            return cached["nvr"]
+        method, args = self._nvr_call(tag, component)
+        builds = self._call(method, *args)
+        nvr = self._select_nvr(builds, tag, component)
+        self.cache.set(key, {"nvr": nvr})
         return nvr
 
     def get_build_hashid(self, build_id, arch="x86_64"):
@@ -105,7 +507,7 @@ class KojiAPI:
         """ Get hash ids of an image for all its architectures from brew """
         hashids = []
         self.logger.debug("Getting hash ids for build " + str(build_id))
-        for archive in self.brew.listArchives(build_id):
+        for archive in self.get_archives(build_id):
             hashid = archive['extra']['docker']['id']
             arch = archive['extra']['image']['arch']
             hashids.append((hashid, arch))
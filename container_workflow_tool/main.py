@@ -18,10 +18,13 @@ from git import Repo
 import container_workflow_tool.utility as u
 from container_workflow_tool.koji import KojiAPI
 from container_workflow_tool.distgit import DistgitAPI
+from container_workflow_tool.build import BuildScheduler
 from container_workflow_tool.utility import RebuilderError
 from container_workflow_tool.decorators import needs_base, needs_brewapi, needs_dhapi
 from container_workflow_tool.decorators import needs_distgit
 from container_workflow_tool.config import Config
+from container_workflow_tool.cache import DiskCache
+from container_workflow_tool.workdirs import WorkdirRegistry, WORKDIR_DB
 
 
 class ImageRebuilder:
@@ -53,9 +56,17 @@ class ImageRebuilder:
         self.exclude_image = None
         self.do_set = None
         self.check_script = None
+        self.check_summary = None
+        self.check_cache = True
+        self.batch = False
+        self.report_format = "text"
+        self.report_size = None
+        self.incremental = False
         self.image_set = None
         self.disable_klist = None
         self.latest_release = None
+        self.koji_stats = None
+        self.jobs = None
 
         self._setup_logger()
         self.set_config(self.conf_name, release=release)
@@ -99,10 +110,26 @@ class ImageRebuilder:
             self.rebuild_reason = args.rebuild_reason
         if getattr(args, 'check_script', None) is not None and args.check_script:
             self.check_script = args.check_script
+        if getattr(args, 'check_summary', None) is not None and args.check_summary:
+            self.check_summary = args.check_summary
+        if getattr(args, 'no_check_cache', None) is not None and args.no_check_cache:
+            self.check_cache = False
+        if getattr(args, 'batch', None) is not None and args.batch:
+            self.batch = args.batch
+        if getattr(args, 'report_format', None) is not None and args.report_format:
+            self.report_format = args.report_format
+        if getattr(args, 'report_size', None) is not None and args.report_size:
+            self.report_size = args.report_size
+        if getattr(args, 'incremental', None) is not None and args.incremental:
+            self.incremental = args.incremental
         if getattr(args, 'disable_klist', None) is not None and args.disable_klist:
             self.disable_klist = args.disable_klist
         if getattr(args, 'latest_release', None) is not None and args.latest_release:
             self.latest_release = args.latest_release
+        if getattr(args, 'koji_stats', None) is not None and args.koji_stats:
+            self.koji_stats = args.koji_stats
+        if getattr(args, 'jobs', None) is not None and args.jobs:
+            self.set_jobs(args.jobs)
 
         # Image set to build
         if getattr(args, 'image_set', None) is not None and args.image_set:
@@ -118,12 +145,14 @@ class ImageRebuilder:
     def _setup_distgit(self):
         if not self.distgit:
             self.distgit = DistgitAPI(self.base_image, self.conf,
-                                      self.rebuild_reason, copy(self.logger))
+                                      self.rebuild_reason, copy(self.logger),
+                                      jobs=self.jobs)
 
     def _setup_brewapi(self):
         if not self.brewapi:
             self.brewapi = KojiAPI(self.conf, copy(self.logger),
-                                   self.latest_release)
+                                   self.latest_release,
+                                   cache_path=self._get_koji_cache_path())
 
     def _setup_dhapi(self):
         from dhwebapi.dhwebapi import DockerHubWebAPI, DockerHubException
@@ -169,23 +198,29 @@ class ImageRebuilder:
         self.logger.info("Using working directory: " + path)
         os.chdir(path)
 
+    def _get_workdirs(self):
+        return WorkdirRegistry(os.path.join(self.conf.cache_dir, WORKDIR_DB))
+
     @needs_base
     def _get_tmp_workdir(self, setup_dir=True):
         # Check if the workdir has been set by the user
         if self.tmp_workdir:
             return self.tmp_workdir
-        tmp = None
-        tmp_id = self.base_image.replace(':', '-')
+        workdirs = self._get_workdirs()
         # Check if there is an existing tempdir for the build
-        for f in os.scandir(tempfile.gettempdir()):
-            if os.path.isdir(f.path) and f.name.startswith(tmp_id):
-                tmp = f.path
-                break
-        else:
-            if setup_dir:
-                tmp = tempfile.mkdtemp(prefix=tmp_id)
+        tmp = workdirs.get(self.base_image, self.conf_id)
+        if tmp is None and setup_dir:
+            tmp_id = self.base_image.replace(':', '-')
+            tmp = tempfile.mkdtemp(prefix=tmp_id)
+            workdirs.register(self.base_image, self.conf_id, tmp)
         return tmp
 
+    def _get_koji_cache_path(self):
+        # Koji data is cached in the working directory set by the user,
+        # otherwise it is shared by all runs through the cache directory
+        path = self.tmp_workdir if self.tmp_workdir else self.conf.cache_dir
+        return os.path.join(path, "koji-cache.db")
+
     def set_do_images(self, val):
         self.do_image = val
 
@@ -246,57 +281,73 @@ class ImageRebuilder:
                 branches += [self.conf.releases[release]["current"]]
         self._prebuild_check(image_set, branches)
 
-        procs = []
         tmp = self._get_tmp_workdir(setup_dir=False)
-        for image in image_set:
-            component = image["component"]
+
+        def start_build(component):
             cwd = os.path.join(tmp, component)
             self.logger.info("Building image {} ...".format(component))
             args = [u._get_packager(self.conf), 'container-build']
             if custom_args:
                 args.extend(custom_args)
-            proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    universal_newlines=True)
-            # Append the process and component information for later use
-            procs.append((proc, component))
-
-        self.logger.info("Fetching tasks...")
-        for proc, component in procs:
-            self.logger.debug("Query component: {}".format(component))
-            # Iterate until a taskID is found
-            for stdout in iter(proc.stdout.readline, ""):
-                if "taskID" in stdout:
-                    self.logger.info("{} - {}".format(component,
-                                                      stdout.strip()))
-                    break
-            else:
-                # If we get here the command must have failed
-                # The error will get printed out later when getting all builds
-                temp = "Could not find task for {}!"
-                self.logger.warning(temp.format(component))
+            return subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
 
+        parents = self._get_build_dependencies(image_set)
+        components = [i["component"] for i in image_set]
+        # Task IDs and finished builds are reported as they show up
         self.logger.info("Waiting for builds...")
-        timeout = 30
-        while procs:
-            self.logger.debug("Looping over all running builds")
-            for proc, image in procs:
-                out = err = None
-                try:
-                    self.logger.debug("Waiting {} seconds for {}".format(timeout,
-                                                                         image))
-                    out, err = proc.communicate(timeout=timeout)
-                except subprocess.TimeoutExpired:
-                    msg = "{} not yet finished, checking next build"
-                    self.logger.debug(msg.format(image))
-                    continue
+        scheduler = BuildScheduler(self.logger, jobs=self.jobs)
+        results = scheduler.run(components, parents, start_build)
+        failed = [c for c in components if results[c] != "succeeded"]
+        if failed:
+            self.logger.error("Failed building images:")
+            for component in failed:
+                self.logger.error(u._2sp("{}: {}".format(component, results[component])))
+        return results
+
+    def _get_build_dependencies(self, image_set):
+        """Finds the parent images of the images being built
+
+        Parents are taken from the FROM line of the downstream Dockerfile.
+        Images without a Dockerfile depend on all images being built
+        in the nearest previous layer as defined by layer_ordering in the config.
 
-                self.logger.info("{} build has finished".format(image))
-                if err:
-                    # Write out stderr if we encounter an error
-                    err = u._4sp(err)
-                    self.logger.error(err)
-                procs.remove((proc, image))
+        Returns:
+            dict: Set of parent components for each component in image_set
+        """
+        tmp = self._get_tmp_workdir(setup_dir=False)
+        by_name = {}
+        for image in image_set:
+            by_name[image["name"]] = image["component"]
+            by_name[image["component"]] = image["component"]
+        layer_of = {}
+        for order, layer in sorted(self.conf.layers.items()):
+            for image in getattr(self.conf, layer, None) or []:
+                layer_of.setdefault(image["component"], order)
+
+        parents = {}
+        for image in image_set:
+            component = image["component"]
+            df_path = os.path.join(tmp, component, "Dockerfile")
+            if os.path.isfile(df_path):
+                base = (self.distgit._get_from(df_path) or "").split()
+                # registry.fedoraproject.org/f27/s2i-core:latest -> s2i-core
+                name = base[0].rsplit('/', 1)[-1] if base else ""
+                name = name.split('@')[0].split(':')[0]
+                parent = by_name.get(name)
+                parents[component] = {parent} if parent not in (None, component) else set()
+            else:
+                order = layer_of.get(component, 0)
+                # Layers without images being built are skipped
+                previous = [layer_of[i["component"]] for i in image_set
+                            if layer_of.get(i["component"], order) < order]
+                parents[component] = set()
+                if previous:
+                    parents[component] = {i["component"] for i in image_set
+                                          if layer_of.get(i["component"]) == max(previous)}
+            msg = "{} depends on: {}"
+            self.logger.debug(msg.format(component, ", ".join(sorted(parents[component]))))
+        return parents
 
     def _get_config_path(self, config):
         if not os.path.isabs(config):
@@ -327,6 +378,8 @@ class ImageRebuilder:
         header += "Archives||"
         output.append(header)
         nvrs = (self.brewapi.get_nvrs(self._get_images()))
+        # Fetch all the data needed for the report at once
+        self.brewapi.prefetch_builds([item[0] for item in nvrs if item[0]])
         for item in nvrs:
             nvr, name, component, *rest = item
             # No nvr found for the image, might not have been built
@@ -336,7 +389,7 @@ class ImageRebuilder:
                 template = "|{0}|{1}|{2}|"
             vr = re.search(".*-([^-]*-[^-]*)$", nvr).group(1)
             build_id = self.brewapi.get_buildinfo(nvr)["build_id"]
-            archives = self.brewapi.brew.listArchives(build_id)
+            archives = self.brewapi.get_archives(build_id)
             archive = archives[0]["extra"]
             name = archive["docker"]["config"]["config"]["Labels"]["name"]
             image_name = "{name}:{vr}".format(name=name, vr=vr)
@@ -347,6 +400,13 @@ class ImageRebuilder:
             output.append(result)
         return '\n'.join(output)
 
+    def print_koji_stats(self):
+        """Prints latency and volume statistics of the Koji hub calls made"""
+        if self.brewapi:
+            print(self.brewapi.stats.format())
+        else:
+            print("No Koji hub calls made.")
+
     def set_config(self, conf_name, release="current"):
         """
         Use a configuration file other than the current one.
@@ -361,6 +421,8 @@ class ImageRebuilder:
         with open(path) as f:
             newconf = Config(f, release)
         self.conf = newconf
+        # Working directories are kept per configuration, see _get_tmp_workdir
+        self.conf_id = "{}:{}".format(path, release)
         # Set config for every module that is set up
         if self.brewapi:
             self.brewapi.conf = newconf
@@ -400,11 +462,28 @@ class ImageRebuilder:
         # If the working directory has been set by the user, recreate it
         if self.tmp_workdir:
             os.makedirs(tmp)
+        else:
+            self._get_workdirs().remove(self.base_image, self.conf_id)
 
-        # Clear koji object caches
+        # Clear koji object caches, the disk cache even if not in use yet
         self.nvrs = []
         if self.brewapi:
             self.brewapi.clear_cache()
+        else:
+            DiskCache(self._get_koji_cache_path(), table="koji").clear()
+
+    def set_jobs(self, jobs):
+        """
+        Sets the maximum number of tasks (builds, clones...) run concurrently.
+
+        Args:
+            jobs(int): Number of concurrent tasks
+        """
+        if jobs < 1:
+            raise RebuilderError("Number of jobs has to be at least 1.")
+        self.jobs = jobs
+        if self.distgit:
+            self.distgit.jobs = jobs
 
     def set_repo_url(self, repo_url):
         """Repofile url setter
@@ -440,17 +519,24 @@ class ImageRebuilder:
             print(key + ":")
             pprint.pprint(value, compact=True, width=256, indent=4)
 
+    @needs_distgit
     def build_images(self, image_set=None):
         """
         Build images specified by image_set (or self.image_set)
+
+        Image set 'all' builds images from all the sets, every image is built
+        once the builds of its parent images have succeeded.
         """
         if image_set is None and self.image_set is None:
             raise RebuilderError("image_set is None, build cancelled.")
         if image_set is None:
             image_set = self.image_set
-        image_config = self._get_set_from_config(image_set)
-        images = self._filter_images(image_config)
-        self._build_images(images)
+        if image_set == "all":
+            images = self._get_images()
+        else:
+            image_config = self._get_set_from_config(image_set)
+            images = self._filter_images(image_config)
+        return self._build_images(images)
 
     def print_brew_builds(self, print_time=True):
         """Prints information about builds in brew
@@ -474,13 +560,17 @@ class ImageRebuilder:
         tmp = self._get_tmp_workdir()
         self._change_workdir(tmp)
         images = self._get_images()
-        for i in images:
-            self.distgit._clone_downstream(i["component"], i["git_branch"])
+        repos = self.distgit.clone_downstreams(images, tmp)
         # If check script is set, run the script provided for each config entry
         if self.check_script:
+            checks = []
             for i in images:
-                self.distgit.check_script(i["component"], self.check_script,
-                                          i["git_branch"])
+                if i["component"] not in repos:
+                    continue
+                path = os.path.join(tmp, i["component"])
+                checks.append((i["component"], path, path))
+            self.distgit.check_scripts(self.check_script, checks, self.check_summary,
+                                       use_cache=self.check_cache)
 
     @needs_distgit
     def pull_upstream(self):
@@ -491,18 +581,17 @@ class ImageRebuilder:
         tmp = self._get_tmp_workdir()
         self._change_workdir(tmp)
         images = self._get_images()
-        for i in images:
-            # Use unversioned name as a path for the repository
-            ups_name = i["name"].split('-')[0]
-            repo = self.distgit._clone_upstream(i["git_url"],
-                                                ups_name,
-                                                commands=i["commands"])
+        # Images sharing an upstream repository share a single clone
+        ups_paths = self.distgit.prepare_upstreams(images, tmp)
         # If check script is set, run the script provided for each config entry
         if self.check_script:
+            checks = []
             for i in images:
-                ups_name = i["name"].split('-')[0]
-                self.distgit.check_script(i["component"], self.check_script,
-                                          os.path.join(ups_name, i["git_path"]))
+                ups_path = ups_paths[i["component"]]
+                checks.append((i["component"], os.path.join(ups_path, i["git_path"]),
+                               ups_path))
+            self.distgit.check_scripts(self.check_script, checks, self.check_summary,
+                                       use_cache=self.check_cache)
 
     @needs_distgit
     def push_changes(self):
@@ -539,7 +628,7 @@ class ImageRebuilder:
         tmp = self._get_tmp_workdir()
         self._change_workdir(tmp)
         images = self._get_images()
-        self.distgit.dist_git_changes(images, rebase)
+        self.distgit.dist_git_changes(images, rebase, incremental=self.incremental)
         self.logger.info("\nGit location: " + tmp)
         if self.args:
             template = "./rebuild-helper {} git show"
@@ -565,13 +654,19 @@ class ImageRebuilder:
         Args:
             components (list of str, optional): List of components to show changes for
         Walks through all downstream repositories and calls 'git-show' on each of them.
+        In batch mode, changes of all repositories are written into a single report instead.
         """
         if not components:
             images = self._get_images()
             components = [i["component"] for i in images]
         tmp = self._get_tmp_workdir()
         self._change_workdir(tmp)
-        self.distgit.show_git_changes(tmp, components)
+        if self.batch:
+            kwargs = {"limit": self.report_size} if self.report_size else {}
+            self.distgit.report_git_changes(tmp, components, fmt=self.report_format,
+                                            **kwargs)
+        else:
+            self.distgit.show_git_changes(tmp, components)
 
     @needs_dhapi
     def update_dh_description(self):  # TODO: handle login if config changes during a run
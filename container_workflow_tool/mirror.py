@@ -0,0 +1,101 @@
+import os
+import re
+import fcntl
+import hashlib
+import threading
+
+from git import Repo
+
+# Refs fetched into mirrors, pull request and other hosting refs are left out
+MIRROR_REFSPECS = ("+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*")
+
+class MirrorCache(object):
+    """Long-lived bare mirrors of remote git repositories
+
+    Every URL gets one bare mirror, created by the first clone and updated
+    by incremental fetches afterwards. Working copies are then cloned from
+    the mirror using alternates, so only new objects are transferred.
+    """
+
+    def __init__(self, path, logger):
+        """
+        Args:
+            path (str): Directory holding the mirrors
+            logger (logging.Logger): Logger used for reporting
+        """
+        self.path = path
+        self.logger = logger
+        # Mirrors are fetched at most once per run
+        self.updated = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def mirror_path(self, url):
+        """Returns the location of the mirror of url"""
+        name = re.sub(r'[^a-zA-Z0-9.-]+', '_', re.sub(r'^[a-z+]+://', '', url))
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.path, "{}-{}".format(name.strip('_'), digest))
+
+    def _url_lock(self, url):
+        with self._lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def update(self, url):
+        """Creates or updates the mirror of url
+
+        Returns:
+            str: Path to the bare mirror
+        """
+        path = self.mirror_path(url)
+        with self._url_lock(url):
+            if url in self.updated:
+                return path
+            os.makedirs(self.path, exist_ok=True)
+            # Guard against other cwt processes using the same cache
+            with open(path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.isdir(path):
+                    self.logger.debug("Fetching into mirror of " + url)
+                    repo = Repo(path)
+                    if repo.config_reader().get_value('remote "origin"', "mirror", False):
+                        # Mirrors of older versions fetched all refs
+                        self._configure(repo)
+                        refs = repo.git.for_each_ref("--format=%(refname)").split("\n")
+                        for ref in refs:
+                            if ref and not ref.startswith(("refs/heads/", "refs/tags/")):
+                                repo.git.update_ref("-d", ref)
+                    repo.git.fetch("--prune", "origin")
+                else:
+                    self.logger.debug("Creating mirror of " + url)
+                    repo = Repo.clone_from(url=url, to_path=path, bare=True)
+                    self._configure(repo)
+            self.updated.add(url)
+        return path
+
+    @staticmethod
+    def _configure(repo):
+        """Sets up a bare clone to be used as a mirror"""
+        # Written without starting git
+        with repo.config_writer() as config:
+            config.remove_option('remote "origin"', "mirror")
+            config.remove_option('remote "origin"', "fetch")
+            for refspec in MIRROR_REFSPECS:
+                config.add_value('remote "origin"', "fetch", refspec)
+            # Working copies borrow objects from the mirror,
+            # so nothing may ever be pruned from it
+            config.set_value("gc", "pruneExpire", "never")
+            config.set_value("gc", "reflogExpireUnreachable", "never")
+
+    def clone(self, url, to_path, **kwargs):
+        """Clones url into to_path using the mirror
+
+        The clone refers to the objects of the mirror instead of copying
+        them, its origin remote points to url.
+
+        Returns:
+            git.Repo: The cloned repository
+        """
+        mirror = self.update(url)
+        repo = Repo.clone_from(url=mirror, to_path=to_path, shared=True, **kwargs)
+        repo.remote().set_url(url)
+        return repo
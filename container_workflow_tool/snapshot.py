@@ -0,0 +1,151 @@
+import io
+import os
+import json
+import hashlib
+import tarfile
+import tempfile
+
+from git import Repo
+
+# Archive member listing files removed by the commands
+DELETED = ".cwt-deleted"
+
+
+class SnapshotCache(object):
+    """Cache of working tree changes made by commands run in upstream repos
+
+    The files a command created, modified or removed in a clone are
+    stored in an archive keyed by the commit the command ran on and
+    the command itself. Applying the archive to a fresh clone of the same
+    commit gives the same result as running the command again.
+    """
+
+    def __init__(self, path, logger):
+        """
+        Args:
+            path (str): Directory holding the snapshots
+            logger (logging.Logger): Logger used for reporting
+        """
+        self.path = path
+        self.logger = logger
+
+    def key(self, commit, commands, *extra):
+        """Returns the key of the snapshot of running commands on commit
+
+        Args:
+            commit (str): Hash of the commit checked out when running commands
+            commands (dict): Commands by the order they are run in
+            extra: Anything else the result depends on
+        """
+        data = json.dumps([commit, sorted(commands.items()), extra])
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def _archive(self, key):
+        return os.path.join(self.path, key + ".tar.gz")
+
+    def save(self, repo, key):
+        """Stores the uncommitted changes of the working tree of repo
+
+        Files changed in submodules are stored as well. No snapshot
+        is stored if the changes cannot be listed file by file.
+
+        Args:
+            repo (git.Repo): Repository the commands were run in
+            key (str): Key of the snapshot
+
+        Returns:
+            bool: True if the snapshot has been stored
+        """
+        root = repo.working_tree_dir
+        changes = self._changes(repo)
+        if changes is None:
+            msg = "Not saving snapshot {}: submodules or nested repositories changed"
+            self.logger.debug(msg.format(key))
+            return False
+        deleted, changed = changes
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, tarfile.open(fileobj=f, mode="w:gz") as tar:
+                for rel in sorted(changed):
+                    tar.add(os.path.join(root, rel), arcname=rel, recursive=False)
+                listing = json.dumps(sorted(deleted)).encode()
+                info = tarfile.TarInfo(DELETED)
+                info.size = len(listing)
+                tar.addfile(info, io.BytesIO(listing))
+            # Other processes only ever see complete snapshots
+            os.replace(tmp, self._archive(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        msg = "Saved snapshot {}: {} files changed, {} removed"
+        self.logger.debug(msg.format(key, len(changed), len(deleted)))
+        return True
+
+    def _changes(self, repo):
+        """Lists the files removed and the files created or modified in repo
+
+        Files of submodules are listed by their paths in repo.
+
+        Returns:
+            tuple: Sets of removed and changed paths, None if the changes
+                   cannot be listed file by file
+        """
+        deleted = set(f for f in repo.git.ls_files("-d", "-z").split("\0") if f)
+        changed = set(f for f in repo.git.ls_files("-m", "-o", "-z").split("\0")
+                      if f and f not in deleted)
+        # Untracked nested repositories are listed as directories
+        if any(f.endswith("/") for f in changed):
+            return None
+        for path in self._submodules(repo):
+            if path in deleted:
+                return None
+            changed.discard(path)
+            if not os.path.exists(os.path.join(repo.working_tree_dir, path, ".git")):
+                # Not checked out
+                continue
+            submodule = Repo(os.path.join(repo.working_tree_dir, path))
+            entry = repo.index.entries.get((path, 0))
+            if entry is None or submodule.head.commit.binsha != entry.binsha:
+                # Another commit has been checked out in the submodule
+                return None
+            changes = self._changes(submodule)
+            if changes is None:
+                return None
+            deleted.update(os.path.join(path, f) for f in changes[0])
+            changed.update(os.path.join(path, f) for f in changes[1])
+        return deleted, changed
+
+    @staticmethod
+    def _submodules(repo):
+        """Returns the paths of the submodules of repo"""
+        if not os.path.isfile(os.path.join(repo.working_tree_dir, ".gitmodules")):
+            return set()
+        out = repo.git.config("-f", ".gitmodules", "--get-regexp", r"^submodule\..*\.path$",
+                              with_exceptions=False)
+        return set(line.split(" ", 1)[1] for line in out.splitlines() if " " in line)
+
+    def restore(self, repo, key):
+        """Applies a stored snapshot to the working tree of repo
+
+        Returns:
+            bool: True if the snapshot exists and has been applied
+        """
+        archive = self._archive(key)
+        if not os.path.isfile(archive):
+            return False
+        root = repo.working_tree_dir
+        with tarfile.open(archive) as tar:
+            members = [m for m in tar.getmembers() if m.name != DELETED]
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(root, members=members, filter="data")
+            else:
+                # Extraction filters are missing in older Pythons
+                tar.extractall(root, members=members)
+            deleted = json.load(tar.extractfile(DELETED))
+        for rel in deleted:
+            path = os.path.join(root, rel)
+            if os.path.lexists(path):
+                os.unlink(path)
+        self.logger.debug("Restored snapshot {}".format(key))
+        return True
@@ -0,0 +1,65 @@
+import json
+import hashlib
+
+from container_workflow_tool.cache import DiskCache
+
+# Name of the database file kept in the working directory
+STATE_DB = "sync-state.db"
+
+
+def config_hash(image, ignore_files, df_ext):
+    """Returns a hash of the settings that affect the pulled content of image
+
+    Covers the commands run in the upstream repository, the upstream path,
+    ref and clone strategy, and the global settings of the sync.
+
+    Args:
+        image (dict): Image from the image set
+        ignore_files (list of str): Downstream files kept by the sync
+        df_ext (str): Extension of the upstream Dockerfile used downstream
+    """
+    data = {"commands": image["commands"], "git_path": image["git_path"],
+            "git_ref": image.get("git_ref") or "",
+            "clone_strategy": image.get("clone_strategy", "full"),
+            "ignore_files": sorted(ignore_files), "df_ext": df_ext}
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+class SyncState(object):
+    """Inputs of the last upstream pull of every image
+
+    For every component, the upstream commit it was synchronized with,
+    the downstream commit the result was based on and a hash
+    of the image settings are stored, see config_hash.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): Location of the database file,
+                                  keeps the state in memory only if not set
+        """
+        self.db = DiskCache(path, table="sync_state")
+
+    def get(self, component):
+        """Returns the inputs of the last pull of component, None if unknown"""
+        return self.db.get(component)
+
+    def record(self, component, upstream, downstream, config):
+        """Stores the inputs of a finished pull
+
+        Args:
+            component (str): Name of the component
+            upstream (str): Upstream commit the component was synchronized with
+            downstream (str): Remote downstream commit the pull was based on
+            config (str): Hash of the image settings, see config_hash
+        """
+        self.db.set(component, {"upstream": upstream, "downstream": downstream,
+                                "config": config})
+
+    def is_current(self, component, upstream, downstream, config):
+        """Checks if a pull with the given inputs has already been done"""
+        if upstream is None or downstream is None:
+            return False
+        state = {"upstream": upstream, "downstream": downstream, "config": config}
+        return self.get(component) == state
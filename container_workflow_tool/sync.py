@@ -0,0 +1,424 @@
+import os
+import stat
+import shutil
+import hashlib
+import collections
+
+# Kinds of manifest entries
+FILE = "file"
+LINK = "link"
+DIR = "dir"
+
+# Maximum number of symlinks followed when resolving a path
+MAX_LINK_DEPTH = 40
+
+# Symlinks replaced by their targets (with the source used), symlinks
+# pointing to themselves and symlinks that could not be replaced
+LinkReport = collections.namedtuple("LinkReport", ["replaced", "cycles", "unresolved"])
+
+
+def _digest(path):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            sha.update(chunk)
+    return sha.digest()
+
+
+def _walk(src, rel_root=""):
+    """Yields manifest entries for the content of src, symlinks are kept
+
+    Yields:
+        tuple: Relative path, manifest entry and the source path
+    """
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel_dir = os.path.relpath(dirpath, src)
+        rel_dir = os.path.normpath(os.path.join(rel_root, rel_dir))
+        for name in list(dirnames):
+            path = os.path.join(dirpath, name)
+            rel = os.path.normpath(os.path.join(rel_dir, name))
+            if os.path.islink(path):
+                # Symlinks to directories are not followed
+                dirnames.remove(name)
+                yield rel, (LINK, os.readlink(path)), path
+            else:
+                yield rel, (DIR, None), path
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.normpath(os.path.join(rel_dir, name))
+            if os.path.islink(path):
+                yield rel, (LINK, os.readlink(path)), path
+            else:
+                yield rel, (FILE, path), path
+
+
+def resolve(manifest, rel, depth=0):
+    """Resolves a path inside of a manifest, following its symlinks
+
+    Args:
+        manifest (dict): Manifest created by build_manifest
+        rel (str): Path relative to the manifest root
+
+    Returns:
+        str: Path of the resolved entry, None if it does not exist
+    """
+    parts = os.path.normpath(rel).split(os.sep)
+    current = ""
+    for i, part in enumerate(parts):
+        current = os.path.normpath(os.path.join(current, part))
+        if current.startswith(os.pardir):
+            return None
+        entry = manifest.get(current)
+        if entry is None:
+            return None
+        kind, value = entry
+        if kind == LINK:
+            if os.path.isabs(value) or depth >= MAX_LINK_DEPTH:
+                return None
+            rest = parts[i + 1:]
+            target = os.path.join(os.path.dirname(current), value, *rest)
+            return resolve(manifest, target, depth + 1)
+    return current
+
+
+class LinkResolver(object):
+    """Replaces symlinks that would be dangling in the destination
+
+    Upstream repositories share files between versions using relative
+    symlinks pointing outside of the copied directory. Such symlinks are
+    replaced by the content their source symlink points to.
+
+    Every symlink is checked once, symlinks in the way of a target are
+    resolved (and replaced if needed) first and resolved paths are
+    memoized, so the work grows with the number of symlinks.
+    """
+
+    def __init__(self, manifest, origins, dest, logger=None):
+        """
+        Args:
+            manifest (dict): Manifest to update in place
+            origins (dict): Source paths of the manifest entries
+            dest (str): Destination directory, targets outside of
+                        the manifest are looked up there, None if they
+                        are never there
+            logger (logging.Logger, optional): Logger used for reporting
+        """
+        self.manifest = manifest
+        self.origins = origins
+        self.dest = dest
+        self.logger = logger
+        self.report = LinkReport([], [], [])
+        self._memo = {}
+        self._checked = {}
+        self._visiting = set()
+        self._queue = collections.deque()
+
+    def run(self):
+        """Checks all symlinks of the manifest
+
+        Returns:
+            LinkReport: Replaced, cyclic and unresolvable symlinks
+        """
+        self._queue.extend(rel for rel, (kind, _) in self.manifest.items()
+                           if kind == LINK)
+        while self._queue:
+            rel = self._queue.popleft()
+            if self.manifest.get(rel, (None,))[0] == LINK:
+                self._check(rel)
+        return self.report
+
+    def _resolve(self, rel):
+        """Returns the resolved path of rel, None if it does not exist
+
+        Symlinks on the way are checked before being followed, so what is
+        memoized cannot change by replacing symlinks later.
+        """
+        if rel in self._memo:
+            return self._memo[rel]
+        cycles = len(self.report.cycles)
+        parent, name = os.path.split(rel)
+        base = self._resolve(parent) if parent else ""
+        result = None
+        if base is not None:
+            path = os.path.join(base, name)
+            entry = self.manifest.get(path)
+            if entry is not None and entry[0] == LINK:
+                self._check(path)
+                entry = self.manifest[path]
+            if entry is None:
+                result = None
+            elif entry[0] != LINK:
+                result = path
+            elif self._checked[path] == "ok" and not os.path.isabs(entry[1]):
+                target = os.path.normpath(os.path.join(base, entry[1]))
+                if not target.startswith(os.pardir):
+                    result = self._resolve(target)
+        # Results depending on a symlink still being checked may change
+        if cycles == len(self.report.cycles):
+            self._memo[rel] = result
+        return result
+
+    def _exists(self, rel, target):
+        target = os.path.normpath(os.path.join(os.path.dirname(rel), target))
+        if target.startswith(os.pardir):
+            return self.dest is not None and os.path.exists(os.path.join(self.dest, target))
+        return self._resolve(target) is not None
+
+    def _check(self, rel):
+        """Makes sure symlink rel is not dangling, replacing it if needed"""
+        if rel in self._checked:
+            return
+        if rel in self._visiting:
+            # The symlink points to itself through other symlinks
+            self._checked[rel] = "cycle"
+            self.report.cycles.append(rel)
+            return
+        self._visiting.add(rel)
+        followed = set()
+        while True:
+            kind, target = self.manifest[rel]
+            cycles = len(self.report.cycles)
+            if (kind != LINK or os.path.isabs(target)
+                    or self._exists(rel, target)):
+                status = "ok"
+                break
+            if rel in self._checked or cycles != len(self.report.cycles):
+                status = "cycle"
+                break
+            # Follow only the first symlink, like a copy would
+            src_path = self.origins[rel]
+            src_full = os.path.join(os.path.dirname(src_path), os.readlink(src_path))
+            if not os.path.lexists(src_full) or src_full in followed:
+                status = "unresolved"
+                self.report.unresolved.append(rel)
+                break
+            followed.add(src_full)
+            self._replace(rel, src_full)
+        self._visiting.discard(rel)
+        if status == "cycle" and rel not in self.report.cycles:
+            self.report.cycles.append(rel)
+        self._checked[rel] = status
+
+    def _replace(self, rel, src_full):
+        if self.logger:
+            msg = "replacing dangling symlink {} by {}"
+            self.logger.debug(msg.format(rel, src_full))
+        self.report.replaced.append((rel, src_full))
+        if os.path.isdir(src_full) and not os.path.islink(src_full):
+            entries = [(rel, (DIR, None), src_full)] + list(_walk(src_full, rel))
+        elif os.path.islink(src_full):
+            entries = [(rel, (LINK, os.readlink(src_full)), src_full)]
+        else:
+            entries = [(rel, (FILE, src_full), src_full)]
+        for path, entry, origin in entries:
+            self.manifest[path] = entry
+            self.origins[path] = origin
+            if entry[0] == LINK and path != rel:
+                self._queue.append(path)
+
+
+def build_manifest(src, dest, logger=None):
+    """Describes the content of src as it should appear in dest
+
+    Symlinks are kept as they are, unless they would be dangling in dest,
+    see LinkResolver.
+
+    Args:
+        src (str): Source directory
+        dest (str): Destination directory, None to replace all symlinks
+                    leading out of src
+        logger (logging.Logger, optional): Logger used for reporting
+
+    Returns:
+        dict: Maps paths relative to src to entries: (FILE, source path),
+              (LINK, symlink target) or (DIR, None)
+    """
+    manifest = {}
+    # Where every entry comes from, symlinks are followed from there
+    origins = {}
+    for rel, entry, path in _walk(src):
+        if rel.split(os.sep)[0] != ".git":
+            manifest[rel] = entry
+            origins[rel] = path
+    report = LinkResolver(manifest, origins, dest, logger).run()
+    if logger and (report.cycles or report.unresolved):
+        msg = "Symlinks left dangling in {}: {}"
+        links = sorted(report.cycles + report.unresolved)
+        logger.warning(msg.format(dest, ", ".join(links)))
+    return manifest
+
+
+def blob_hash(data):
+    """Returns the git object hash of a blob with content data"""
+    header = "blob {}\0".format(len(data)).encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def git_entries(manifest, blobs=None):
+    """Returns the git index entries the manifest would produce
+
+    Args:
+        manifest (dict): Manifest created by build_manifest
+        blobs (dict, optional): Known (mode, hash) of source files,
+                                other files are read and hashed
+
+    Returns:
+        dict: Maps paths to (mode, object hash) tuples
+    """
+    blobs = blobs or {}
+    entries = {}
+    for rel, (kind, value) in manifest.items():
+        if kind == LINK:
+            entries[rel] = ("120000", blob_hash(os.fsencode(value)))
+        elif kind == FILE:
+            known = blobs.get(os.path.normpath(value))
+            if known is None:
+                mode = "100755" if os.stat(value).st_mode & stat.S_IXUSR else "100644"
+                with open(value, "rb") as f:
+                    known = (mode, blob_hash(f.read()))
+            entries[rel] = known
+    return entries
+
+
+def tree_hash(entries):
+    """Computes the hash of the git tree containing entries
+
+    Args:
+        entries (dict): Maps paths to (mode, object hash) tuples
+
+    Returns:
+        str: Hash of the root tree object
+    """
+    root = {}
+    for rel, entry in entries.items():
+        node = root
+        *dirs, name = rel.split(os.sep)
+        for d in dirs:
+            node = node.setdefault(d, {})
+        node[name] = entry
+    return _tree_hash(root)
+
+
+def content_hash(path, blobs=None):
+    """Computes the git tree hash of the content of directory path
+
+    A top-level .git directory is left out. Relative symlinks leading out
+    of path are hashed as the content they point to, other symlinks are
+    not followed.
+
+    Args:
+        path (str): Directory to compute the hash of
+        blobs (dict, optional): Known (mode, hash) of files, see git_entries
+
+    Returns:
+        str: Hash of the tree git would store for the directory
+    """
+    return tree_hash(git_entries(build_manifest(path, None), blobs))
+
+
+def _tree_hash(node):
+    items = []
+    for name, value in node.items():
+        if isinstance(value, dict):
+            # Git sorts trees as if their names ended with a slash
+            items.append((name + "/", "40000", _tree_hash(value), name))
+        else:
+            items.append((name, value[0], value[1], name))
+    data = b"".join(mode.encode() + b" " + os.fsencode(name) + b"\0" + bytes.fromhex(sha)
+                    for key, mode, sha, name in sorted(items))
+    header = "tree {}\0".format(len(data)).encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def _prune_dirs(path, root):
+    """Removes empty directories from path up to root"""
+    path, root = os.path.normpath(path), os.path.normpath(root)
+    while path != root:
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
+
+
+def _same_file(src, dest):
+    """Compares a source file with the destination by size, mode and content
+
+    Only the executable bit of the mode is compared, as git does.
+    """
+    try:
+        dest_stat = os.lstat(dest)
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(dest_stat.st_mode):
+        return False
+    src_stat = os.stat(src)
+    if src_stat.st_size != dest_stat.st_size:
+        return False
+    if (src_stat.st_mode ^ dest_stat.st_mode) & stat.S_IXUSR:
+        return False
+    return _digest(src) == _digest(dest)
+
+
+def sync_tree(manifest, dest, tracked, protected=(), logger=None):
+    """Makes dest match the manifest, touching only what differs
+
+    Entries are compared by type, symlink target, size, executable bit
+    and content hash, only changed ones are written. Tracked files missing
+    in the manifest are removed, untracked files are left alone.
+
+    Args:
+        manifest (dict): Manifest created by build_manifest
+        dest (str): Destination directory
+        tracked (iterable of str): Files tracked in dest, relative to it
+        protected (iterable of str): Paths that are never modified
+        logger (logging.Logger, optional): Logger used for reporting
+
+    Returns:
+        tuple: Lists of written and removed paths, relative to dest
+    """
+    protected = set(protected)
+    changed = []
+    removed = []
+    for rel in sorted(set(tracked) - set(manifest) - protected):
+        path = os.path.join(dest, rel)
+        if os.path.lexists(path):
+            if logger:
+                logger.debug("rm {}".format(path))
+            _remove(path)
+            _prune_dirs(os.path.dirname(path), dest)
+        removed.append(rel)
+    # Parents are sorted before their content
+    for rel in sorted(manifest):
+        if rel in protected:
+            continue
+        kind, value = manifest[rel]
+        path = os.path.join(dest, rel)
+        if kind == DIR:
+            if not os.path.isdir(path) or os.path.islink(path):
+                _remove(path)
+                os.makedirs(path)
+            continue
+        if kind == LINK:
+            if os.path.islink(path) and os.readlink(path) == value:
+                continue
+            _remove(path)
+            if logger:
+                logger.debug("ln -s {} {}".format(value, path))
+            os.symlink(value, path)
+        else:
+            if _same_file(value, path):
+                continue
+            _remove(path)
+            if logger:
+                logger.debug("cp {} {}".format(value, path))
+            shutil.copy2(value, path)
+        changed.append(rel)
+    return changed, removed
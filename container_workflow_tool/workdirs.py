@@ -0,0 +1,70 @@
+import os
+
+from container_workflow_tool.cache import DiskCache
+
+# Name of the database file kept in the cache directory
+WORKDIR_DB = "workdirs.db"
+
+
+class WorkdirRegistry(object):
+    """Registry of temporary working directories and the repositories in them
+
+    Maps a base image and a configuration to the working directory used
+    for them, so it can be found again without scanning the system
+    temporary directory. For every downstream repository cloned into
+    a working directory, the branch it was cloned for is recorded.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): Location of the database file,
+                                  keeps the data in memory only if not set
+        """
+        self.workdirs = DiskCache(path, table="workdirs")
+        self.clones = DiskCache(path, table="workdir_clones")
+
+    @staticmethod
+    def _key(base_image, config):
+        return "{}\0{}".format(base_image, config)
+
+    def get(self, base_image, config):
+        """Returns the working directory of base_image and config
+
+        Args:
+            base_image (str): Base image the working directory is used for
+            config (str): Identifier of the configuration in use
+
+        Returns:
+            str: Path of the directory, None if unknown or no longer existing
+        """
+        key = self._key(base_image, config)
+        path = self.workdirs.get(key)
+        if path is not None and not os.path.isdir(path):
+            self.workdirs.delete(key)
+            return None
+        return path
+
+    def register(self, base_image, config, path):
+        """Records path as the working directory of base_image and config"""
+        self.workdirs.set(self._key(base_image, config), path)
+
+    def remove(self, base_image, config):
+        """Forgets the working directory of base_image and config"""
+        self.workdirs.delete(self._key(base_image, config))
+
+    def clone_state(self, path):
+        """Returns the recorded state of the repository cloned into path
+
+        Returns:
+            dict: Branch the repository was cloned for, None if unknown
+        """
+        return self.clones.get(os.path.abspath(path))
+
+    def record_clone(self, path, branch):
+        """Records a finished clone of a repository into path"""
+        self.clones.set(os.path.abspath(path), {"branch": branch})
+
+    def forget_clone(self, path):
+        """Removes the recorded state of the repository in path"""
+        self.clones.delete(os.path.abspath(path))
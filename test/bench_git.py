@@ -0,0 +1,123 @@
+"""Benchmark of git processes started when pulling upstream into dist-git
+
+Every git invocation goes through a wrapper counting them, the pull is run
+on a set of synthetic images twice: with upstream changes and without.
+With the defaults, 12 git processes are started per image with upstream
+changes and 6 without, clones of the upstreams included.
+
+Usage: python3 test/bench_git.py [--images N] [--files N]
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import collections
+import tempfile
+import subprocess
+
+WRAPPER = """#!/bin/sh
+echo "$1" >> {log}
+exec {git} "$@"
+"""
+
+
+def install_wrapper(path):
+    """Puts a counting git wrapper in front of the real git"""
+    git = shutil.which("git")
+    log = os.path.join(path, "calls.log")
+    os.makedirs(os.path.join(path, "bin"))
+    wrapper = os.path.join(path, "bin", "git")
+    with open(wrapper, "w") as f:
+        f.write(WRAPPER.format(log=log, git=git))
+    os.chmod(wrapper, 0o755)
+    os.environ["PATH"] = os.path.dirname(wrapper) + os.pathsep + os.environ["PATH"]
+    os.environ["GIT_PYTHON_GIT_EXECUTABLE"] = wrapper
+    return log
+
+
+def git(cwd, *args):
+    subprocess.run(("git",) + args, cwd=cwd, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL)
+
+
+def create_images(path, count, files):
+    """Creates upstream and downstream repositories of count images"""
+    images = []
+    for i in range(count):
+        name = "image{}".format(i)
+        upstream = os.path.join(path, "upstream", name)
+        os.makedirs(os.path.join(upstream, "1.0", "root"))
+        for f in range(files):
+            with open(os.path.join(upstream, "1.0", "root", "f{}".format(f)), "w") as fd:
+                fd.write("content {}\n".format(f))
+        with open(os.path.join(upstream, "1.0", "Dockerfile"), "w") as fd:
+            fd.write("FROM base\n")
+        with open(os.path.join(upstream, "1.0", "README.md"), "w") as fd:
+            fd.write("README\n")
+        git(upstream, "init", "-q")
+        git(upstream, "add", "-A")
+        git(upstream, "commit", "-q", "-m", "Initial")
+        initial = os.path.join(path, "initial", name)
+        os.makedirs(initial)
+        with open(os.path.join(initial, "Dockerfile"), "w") as fd:
+            fd.write("FROM old\n")
+        git(initial, "init", "-q", "-b", "master")
+        git(initial, "add", "-A")
+        git(initial, "commit", "-q", "-m", "Initial")
+        remote = os.path.join(path, "remote", name + ".git")
+        git(path, "clone", "-q", "--bare", initial, remote)
+        git(path, "clone", "-q", remote, os.path.join(path, "work", name))
+        images.append({"name": name, "component": name, "git_branch": "master",
+                       "git_url": upstream, "git_path": "1.0", "commands": {}})
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--files', type=int, default=200)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        for name in ("AUTHOR", "COMMITTER"):
+            os.environ.setdefault("GIT_{}_NAME".format(name), "bench")
+            os.environ.setdefault("GIT_{}_EMAIL".format(name), "bench@localhost")
+        images = create_images(tmp, args.images, args.files)
+        log = install_wrapper(tmp)
+        # GitPython picks the wrapper up when imported
+        from container_workflow_tool.config import Config
+        from container_workflow_tool.distgit import DistgitAPI
+        conf = Config.__new__(Config)
+        conf.update(ignore_files=["Dockerfile.rhel7"], df_ext=".fedora",
+                    rebuild_reason="bench", jobs=4,
+                    cache_dir=os.path.join(tmp, "cache"))
+        logger = logging.getLogger("bench")
+        logger.setLevel(logging.ERROR)
+        distgit = DistgitAPI("bench", conf, None, logger)
+        os.chdir(os.path.join(tmp, "work"))
+        template = "{:>10} {:>7} {:>13} {:>9}"
+        print("{} images, {} files each".format(args.images, args.files))
+        print(template.format("run", "forks", "forks/image", "seconds"))
+        for run in ("changed", "unchanged"):
+            open(log, "w").close()
+            start = time.time()
+            distgit.dist_git_changes(images)
+            duration = time.time() - start
+            with open(log) as f:
+                calls = collections.Counter(f.read().split())
+            forks = sum(calls.values())
+            print(template.format(run, forks, "{:.1f}".format(forks / args.images),
+                                  "{:.2f}".format(duration)))
+            print("    " + ", ".join("{} {}".format(c, n) for c, n in calls.most_common()))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
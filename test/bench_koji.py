@@ -0,0 +1,51 @@
+"""Benchmark of KojiAPI look-ups against a local fake hub
+
+Usage: python3 test/bench_koji.py [--images N] [--latency SECONDS]
+"""
+import sys
+import time
+import logging
+import argparse
+
+from test.fake_koji import FakeKojiHub
+from container_workflow_tool.koji import KojiAPI
+
+
+def run(hub, images, workers, batch_size):
+    conf = argparse.Namespace(koji_url=hub.url, koji_workers=workers,
+                              koji_batch_size=batch_size)
+    logger = logging.getLogger("bench")
+    logger.setLevel(logging.ERROR)
+    api = KojiAPI(conf, logger)
+    requests = hub.requests
+    start = time.time()
+    nvrs = api.get_nvrs(images)
+    api.prefetch_builds([nvr for nvr, *rest in nvrs if nvr])
+    return time.time() - start, hub.requests - requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    components = ["image{}".format(i) for i in range(args.images)]
+    hub = FakeKojiHub.synthetic(components, latency=args.latency).start()
+    images = [{"name": c, "component": c, "build_tag": "f26-container"}
+              for c in components]
+    template = "{:>8} {:>11} {:>9} {:>9}"
+    print("{} images, {}s request latency".format(args.images, args.latency))
+    print(template.format("workers", "batch_size", "requests", "seconds"))
+    try:
+        for workers, batch_size in [(1, 1), (1, 50), (4, 50), (8, 25)]:
+            duration, requests = run(hub, images, workers, batch_size)
+            print(template.format(workers, batch_size, requests,
+                                  "{:.2f}".format(duration)))
+    finally:
+        hub.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Benchmark of upstream to downstream synchronization on a synthetic tree
+
+Every version directory links to files and directories shared by all
+versions, the way sclorg repositories do.
+
+Usage: python3 test/bench_sync.py [--links N] [--versions N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+from container_workflow_tool import sync
+
+
+def create_tree(path, versions, links):
+    """Creates an upstream tree with versions and shared content"""
+    shared = os.path.join(path, "common")
+    os.makedirs(os.path.join(path, "root-common", "bin"))
+    for i in range(links):
+        os.makedirs(os.path.join(shared, "d{}".format(i % 50)), exist_ok=True)
+        with open(os.path.join(shared, "d{}".format(i % 50), "f{}".format(i)), "w") as f:
+            f.write("shared {}\n".format(i))
+    for v in range(versions):
+        version = os.path.join(path, "{}.0".format(v))
+        os.makedirs(os.path.join(version, "test"))
+        os.symlink("../common", os.path.join(version, "common"))
+        os.symlink("../root-common", os.path.join(version, "root-common"))
+        with open(os.path.join(version, "Dockerfile"), "w") as f:
+            f.write("FROM base\n")
+        for i in range(links):
+            # Alternate links into the shared tree and links going through
+            # the replaced "common" symlink
+            if i % 2:
+                target = "../../common/d{}/f{}".format(i % 50, i)
+            else:
+                target = "../common/d{}/f{}".format(i % 50, i)
+            os.symlink(target, os.path.join(version, "test", "l{}".format(i)))
+
+
+def run(src, dest):
+    start = time.time()
+    manifest = sync.build_manifest(src, dest)
+    resolved = time.time()
+    sync.sync_tree(manifest, dest, [])
+    synced = time.time()
+    # Nothing changes on the second run
+    tracked = [rel for rel, (kind, _) in manifest.items() if kind != sync.DIR]
+    sync.sync_tree(sync.build_manifest(src, dest), dest, tracked)
+    return len(manifest), resolved - start, synced - resolved, time.time() - synced
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--links', type=int, default=4000)
+    parser.add_argument('--versions', type=int, default=2)
+    args = parser.parse_args()
+
+    template = "{:>7} {:>8} {:>9} {:>8} {:>9}"
+    print(template.format("links", "entries", "resolve", "sync", "resync"))
+    for links in (args.links // 4, args.links // 2, args.links):
+        tmp = tempfile.mkdtemp()
+        # Shared content must not be reachable from the destination
+        dest = tempfile.mkdtemp()
+        try:
+            create_tree(tmp, args.versions, links)
+            entries, resolve, copy, resync = run(os.path.join(tmp, "0.0"), dest)
+            print(template.format(links, entries, "{:.2f}s".format(resolve),
+                                  "{:.2f}s".format(copy), "{:.2f}s".format(resync)))
+        finally:
+            shutil.rmtree(tmp)
+            shutil.rmtree(dest)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,13 @@
 import unittest
 import os
 import sys
+import shutil
+import tempfile
 from io import StringIO
 import logging
 
+from git import Repo
+
 from container_workflow_tool.main import ImageRebuilder
 
 
@@ -21,12 +25,31 @@ def create_logger(out_file, level, c_name=None):
     return logger
 
 
+def create_upstream(path, files, links=None):
+    """Creates a local git repository containing files and symlinks"""
+    repo = Repo.init(path)
+    # Allow partial clones from the repository
+    repo.git.config("uploadpack.allowFilter", "true")
+    for name, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(path, name)), exist_ok=True)
+        with open(os.path.join(path, name), "w") as f:
+            f.write(content)
+    for name, target in (links or {}).items():
+        os.symlink(target, os.path.join(path, name))
+    repo.git.add("-A")
+    repo.git.commit("-m", "Initial commit")
+    return repo
+
+
 class TestCaseBase(unittest.TestCase):
     def setUp(self, c_logger=None):
         self.cwd = os.getcwd()
         self.component = 's2i-base'
         self.ir = ImageRebuilder('Testing')
-        self.ir.set_config('default.yaml', release="fedora26")
+        # Caches and registries are kept out of the real cache directory
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.set_config('default.yaml', release="fedora26")
         # Partner BZ testing
         self.ir.rebuild_reason = "Unit testing"
         self.ir.set_do_images([self.component])
@@ -35,6 +58,10 @@ class TestCaseBase(unittest.TestCase):
                                                          logging.ERROR)
         self.ir._setup_logger(user_logger=logger)
 
+    def set_config(self, conf_name, release="current"):
+        self.ir.set_config(conf_name, release=release)
+        self.ir.conf.cache_dir = self.cache_dir
+
     def tearDown(self):
         os.chdir(self.cwd)
         self.ir.clear_cache()
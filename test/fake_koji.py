@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import threading
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data",
+                        "koji_fixtures.json")
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ('/', '/kojihub')
+
+    def do_POST(self):
+        # Simulate the network round trip to a remote hub
+        if self.server.hub.latency:
+            time.sleep(self.server.hub.latency)
+        with self.server.hub.lock:
+            self.server.hub.requests += 1
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeKojiHub(object):
+    """Local stand-in for a Koji hub answering from fixture data
+
+    Only the calls used by KojiAPI are implemented: getBuild,
+    getLatestBuilds, listTagged, listArchives, getTaskInfo and multiCall.
+    """
+
+    def __init__(self, data=None, latency=0):
+        """
+        Args:
+            data (dict, optional): Hub content in the format of
+                                   test/data/koji_fixtures.json, the
+                                   recorded fixtures are used if not set
+            latency (float, optional): Delay in seconds added to every request
+        """
+        if data is None:
+            with open(FIXTURES) as f:
+                data = json.load(f)
+        self.builds = {b["nvr"]: b for b in data["builds"]}
+        self.builds_by_id = {b["build_id"]: b for b in data["builds"]}
+        # Builds in the order they have been tagged, oldest first
+        self.tags = data["tags"]
+        self.archives = {int(k): v for k, v in data["archives"].items()}
+        self.tasks = {int(k): v for k, v in data.get("tasks", {}).items()}
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    @classmethod
+    def synthetic(cls, components, builds=3, tag="f26-container", latency=0):
+        """Creates a hub with generated builds for the given components
+
+        Args:
+            components (list of str): Names of the components
+            builds (int, optional): Number of builds tagged per component
+            tag (str, optional): Tag all the builds are tagged into
+            latency (float, optional): Delay in seconds added to every request
+        """
+        data = {"tags": {tag: []}, "builds": [], "archives": {}}
+        build_id = 1
+        for release in range(1, builds + 1):
+            for component in components:
+                nvr = "{}-0-{}.f26container".format(component, release)
+                data["builds"].append({
+                    "build_id": build_id, "package_name": component,
+                    "name": component, "version": "0",
+                    "release": "{}.f26container".format(release),
+                    "epoch": None, "nvr": nvr, "state": 1,
+                    "completion_time": "2018-01-18 15:04:41.137516",
+                })
+                data["tags"][tag].append(nvr)
+                data["archives"][str(build_id)] = [{
+                    "build_id": build_id,
+                    "extra": {
+                        "docker": {
+                            "id": "sha256:{:064x}".format(build_id),
+                            "config": {"config": {"Labels": {"name": "f26/" + component}}},
+                        },
+                        "image": {"arch": "x86_64"},
+                    },
+                }]
+                build_id += 1
+        return cls(data, latency=latency)
+
+    @property
+    def url(self):
+        return "http://{}:{}/kojihub".format(*self.server.server_address)
+
+    def start(self):
+        """Starts serving requests in a background thread"""
+        self.server = _Server(("127.0.0.1", 0), requestHandler=_RequestHandler,
+                              allow_none=True, logRequests=False)
+        self.server.hub = self
+        for name in ["getBuild", "getLatestBuilds", "listTagged",
+                     "listArchives", "getTaskInfo"]:
+            self.server.register_function(getattr(self, name), name)
+        self.server.register_function(self.server.system_multicall, "multiCall")
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _tagged(self, tag, package=None):
+        # Koji lists the most recently tagged builds first
+        builds = [self.builds[nvr] for nvr in reversed(self.tags.get(tag, []))]
+        if package is not None:
+            builds = [b for b in builds if b["package_name"] == package]
+        return builds
+
+    def getBuild(self, buildInfo, strict=False):
+        if isinstance(buildInfo, int):
+            return self.builds_by_id.get(buildInfo)
+        return self.builds.get(buildInfo)
+
+    def getLatestBuilds(self, tag, event=None, package=None, type=None):
+        return self.listTagged(tag, event, False, None, True, package)
+
+    def listTagged(self, tag, event=None, inherit=False, prefix=None,
+                   latest=False, package=None, owner=None, type=None):
+        builds = self._tagged(tag, package)
+        if latest:
+            # True means one build per package, an integer N the N latest
+            limit = 1 if latest is True else int(latest)
+            seen = {}
+            result = []
+            for b in builds:
+                seen[b["package_name"]] = seen.get(b["package_name"], 0) + 1
+                if seen[b["package_name"]] <= limit:
+                    result.append(b)
+            builds = result
+        return builds
+
+    def listArchives(self, buildID=None, *args):
+        return self.archives.get(buildID, [])
+
+    def getTaskInfo(self, task_id, request=False, strict=False):
+        return self.tasks.get(task_id)
@@ -1,13 +1,29 @@
 import unittest
+import os
+import time
+import shutil
+import tempfile
+
 from test.common import TestCaseBase
+from test.fake_koji import FakeKojiHub
+from container_workflow_tool.koji import KojiAPI, rpmvercmp, compare_builds
 
 
 class BrewTestCase(TestCaseBase):
+    @classmethod
+    def setUpClass(cls):
+        cls.hub = FakeKojiHub().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hub.stop()
+
     def setUp(self):
         super(BrewTestCase, self).setUp()
         self.component = 'postgresql'
         self.nvr = 'postgresql-0-1.f26container'
         self.ir.set_do_images([self.component])
+        self.ir.conf.koji_url = self.hub.url
         self.ir._setup_brewapi()
 
     def test_setup_brewapi(self):
@@ -21,6 +37,36 @@ class BrewTestCase(TestCaseBase):
         nvr = self.ir.brewapi.get_nvr('f26-container', self.component)
         self.assertIn(self.nvr, nvr)
 
+    def test_get_nvr_latest_release(self):
+        self.ir.brewapi.latest_by_nvr = True
+        nvr = self.ir.brewapi.get_nvr('f26-container', self.component)
+        self.assertEqual(self.nvr, nvr)
+
+    def test_get_nvrs(self):
+        images = [{"name": "postgresql", "component": self.component,
+                   "build_tag": "f26-container"},
+                  {"name": "missing", "component": "missing",
+                   "build_tag": "f26-container"}]
+        nvrs = self.ir.brewapi.get_nvrs(images)
+        self.assertEqual(nvrs, [(self.nvr, "postgresql", self.component),
+                                (None, "missing", "missing")])
+
+    def test_prefetch_builds(self):
+        self.ir.brewapi.prefetch_builds([self.nvr])
+        requests = self.hub.requests
+        self.assertEqual(self.ir.brewapi.get_buildinfo(self.nvr)['build_id'], 1018414)
+        self.assertEqual(len(self.ir.brewapi.get_archives(1018414)), 1)
+        self.assertEqual(self.hub.requests, requests)
+
+    def test_stats(self):
+        self.ir.brewapi.get_taskinfo(24268996)
+        self.ir.brewapi.get_buildinfo(self.nvr)
+        self.ir.brewapi.get_buildinfo(self.nvr)
+        stats = self.ir.brewapi.get_stats()
+        self.assertEqual(stats['methods']['getTaskInfo']['count'], 1)
+        self.assertGreater(stats['methods']['getTaskInfo']['bytes'], 0)
+        self.assertEqual(stats['cache']['buildinfo']['hits'], 1)
+
     def test_get_buildinfo(self):
         buildinfo = self.ir.brewapi.get_buildinfo(self.nvr)
         self.assertIn('build_id', buildinfo)
@@ -31,6 +77,65 @@ class BrewTestCase(TestCaseBase):
         self.assertIn('create_ts', taskinfo)
         self.assertEqual(taskinfo['create_ts'], 1516286326.9219)
 
+    def test_cache_path(self):
+        # Without a working directory the cache is kept in cache_dir
+        self.assertEqual(self.ir._get_koji_cache_path(),
+                         os.path.join(self.cache_dir, "koji-cache.db"))
+        self.assertEqual(self.ir._get_tmp_workdir(setup_dir=False), None)
+
+    def test_clear_disk_cache(self):
+        path = self.ir._get_koji_cache_path()
+        self.ir.brewapi.get_buildinfo(self.nvr)
+        # A new run clears the cache before setting up the API
+        super(BrewTestCase, self).setUp()
+        self.ir.conf.cache_dir = os.path.dirname(path)
+        self.assertEqual(self.ir.brewapi, None)
+        self.ir.clear_cache()
+        self.assertEqual(self.create_api(path).cache.get('build:' + self.nvr), None)
+
+    def create_api(self, path):
+        return KojiAPI(self.ir.conf, self.ir.logger, cache_path=path)
+
+    def test_disk_cache(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, "koji-cache.db")
+        api = self.create_api(path)
+        api.get_nvr('f26-container', self.component)
+        api.get_buildinfo(self.nvr)
+        # Another run finds everything on disk
+        requests = self.hub.requests
+        api = self.create_api(path)
+        self.assertEqual(api.get_nvr('f26-container', self.component), self.nvr)
+        self.assertEqual(api.get_buildinfo(self.nvr)['build_id'], 1018414)
+        self.assertEqual(self.hub.requests, requests)
+        # Latest builds expire, finished builds do not
+        api = self.create_api(path)
+        api.cache_ttl = 0
+        time.sleep(0.01)
+        api.get_nvr('f26-container', self.component)
+        self.assertEqual(self.hub.requests, requests + 1)
+        api.get_buildinfo(self.nvr)
+        self.assertEqual(self.hub.requests, requests + 1)
+        api.clear_cache()
+        api = self.create_api(path)
+        api.get_buildinfo(self.nvr)
+        self.assertEqual(self.hub.requests, requests + 2)
+
+
+class VersionCompareTestCase(unittest.TestCase):
+    def test_rpmvercmp(self):
+        self.assertEqual(rpmvercmp('1.2.10', '1.2.3'), 1)
+        self.assertEqual(rpmvercmp('1.fc26', '1.fc27'), -1)
+        self.assertEqual(rpmvercmp('1.0~rc1', '1.0'), -1)
+        self.assertEqual(rpmvercmp('1.0', '1.0'), 0)
+
+    def test_compare_builds(self):
+        old = {'epoch': None, 'version': '0', 'release': '9.f26container'}
+        new = {'epoch': None, 'version': '0', 'release': '10.f26container'}
+        self.assertEqual(compare_builds(new, old), 1)
+        self.assertEqual(compare_builds(old, new), -1)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+
+from container_workflow_tool.build import BuildMonitor, BuildScheduler
+from container_workflow_tool.utility import RebuilderError
+from test.common import TestCaseBase
+
+
+def start(script):
+    return subprocess.Popen(["sh", "-c", script], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+
+class BuildMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test-build")
+        self.logger.setLevel(logging.CRITICAL)
+
+    def test_completion_order(self):
+        monitor = BuildMonitor(self.logger)
+        monitor.add(start("echo 'Created task: 1'; echo 'taskID: 1'; sleep 1"), "slow")
+        monitor.add(start("echo 'taskID: 2'; echo failed >&2; exit 1"), "fast")
+        builds = monitor.run()
+        self.assertEqual([b.component for b in builds], ["fast", "slow"])
+        self.assertEqual(builds[0].returncode, 1)
+        self.assertEqual(builds[0].stderr, "failed\n")
+        self.assertEqual(builds[1].task, "taskID: 1")
+
+    def test_large_stderr(self):
+        monitor = BuildMonitor(self.logger)
+        monitor.add(start("head -c 1000000 /dev/zero >&2; echo 'taskID: 3'"), "noisy")
+        build, = monitor.run()
+        self.assertEqual(build.returncode, 0)
+        self.assertEqual(build.task, "taskID: 3")
+
+
+class BuildSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger("test-build")
+        self.logger.setLevel(logging.CRITICAL)
+        self.started = []
+
+    def start(self, component):
+        self.started.append(component)
+        return start("exit 1" if component == "broken" else "echo 'taskID: 1'")
+
+    def test_dependency_order(self):
+        parents = {"s2i-base": {"s2i-core"}, "python3": {"s2i-base"},
+                   "nodejs": {"broken"}}
+        components = ["python3", "nodejs", "s2i-base", "s2i-core", "broken"]
+        results = BuildScheduler(self.logger, jobs=2).run(components, parents,
+                                                          self.start)
+        self.assertLess(self.started.index("s2i-core"), self.started.index("s2i-base"))
+        self.assertLess(self.started.index("s2i-base"), self.started.index("python3"))
+        self.assertNotIn("nodejs", self.started)
+        self.assertEqual(results["python3"], "succeeded")
+        self.assertEqual(results["broken"], "failed")
+        self.assertEqual(results["nodejs"], "skipped")
+
+    def test_cycle(self):
+        parents = {"a": {"b"}, "b": {"a"}}
+        with self.assertRaises(RebuilderError):
+            BuildScheduler(self.logger).run(["a", "b"], parents, self.start)
+        self.assertEqual(self.started, [])
+
+
+class BuildDependenciesTestCase(TestCaseBase):
+    def setUp(self):
+        super(BuildDependenciesTestCase, self).setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.ir.set_tmp_workdir(tmp)
+        self.ir.set_do_images(None)
+        self.ir._setup_distgit()
+        dockerfiles = {
+            "s2i-base": "FROM registry.fedoraproject.org/f27/s2i-core:latest",
+            "python3": "FROM registry.example.com:5000/f26/s2i-base@sha256:0123 AS builder",
+            "postgresql": "FROM fedora:26",
+            "s2i-core": "FROM s2i-core",
+        }
+        for component, line in dockerfiles.items():
+            os.makedirs(os.path.join(tmp, component))
+            with open(os.path.join(tmp, component, "Dockerfile"), "w") as f:
+                f.write(line + "\nRUN true\n")
+
+    def test_build_dependencies(self):
+        parents = self.ir._get_build_dependencies(self.ir._get_images())
+        # Registry, tag and digest are stripped from FROM
+        self.assertEqual(parents["s2i-base"], {"s2i-core"})
+        self.assertEqual(parents["python3"], {"s2i-base"})
+        # Images outside of the set and the image itself are not parents
+        self.assertEqual(parents["postgresql"], set())
+        self.assertEqual(parents["s2i-core"], set())
+        # Without a Dockerfile, all images of the previous layer are parents
+        self.assertEqual(parents["mongodb"], {"s2i-core", "postgresql", "redis"})
+        self.assertEqual(parents["redis"], set())
+
+    def test_build_dependencies_subset(self):
+        os.remove(os.path.join(self.ir.tmp_workdir, "python3", "Dockerfile"))
+        # Nothing of the previous layer is built, the one before is used
+        images = [i for i in self.ir._get_images()
+                  if i["component"] in ("s2i-core", "redis", "python3")]
+        parents = self.ir._get_build_dependencies(images)
+        self.assertEqual(parents["python3"], {"s2i-core", "redis"})
+
+
+if __name__ == '__main__':
+    unittest.main()
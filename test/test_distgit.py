@@ -1,13 +1,63 @@
 import unittest
+import io
 import os
+import json
+import shutil
+import tempfile
+import sys
+import logging
 
-from test.common import TestCaseBase
+from git import Repo
+
+from container_workflow_tool import distgit as distgit_module
+from container_workflow_tool.mirror import MirrorCache
+from container_workflow_tool.utility import RebuilderError
+from container_workflow_tool.workdirs import WorkdirRegistry
+from test.common import TestCaseBase, create_logger, create_upstream
 
 
 class DistgitTestCase(TestCaseBase):
     def setUp(self):
         super(DistgitTestCase, self).setUp()
         self.ir._setup_distgit()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def create_downstream(self, components, files=None, branches=()):
+        """Creates dist-git repositories and clones them into the work directory
+
+        Every repository starts from the same commit with files and branches,
+        the current directory is changed to the work directory.
+
+        Returns:
+            dict: Clone of every component
+        """
+        initial = create_upstream(os.path.join(self.tmp, "initial"),
+                                  files or {"Dockerfile": "FROM b"})
+        for branch in branches:
+            initial.create_head(branch)
+        os.makedirs(os.path.join(self.tmp, "work"))
+        os.chdir(os.path.join(self.tmp, "work"))
+        repos = {}
+        for component in components:
+            remote = os.path.join(self.tmp, component + ".git")
+            Repo.clone_from(initial.working_tree_dir, remote, bare=True)
+            repos[component] = Repo.clone_from(remote, component)
+        return repos
+
+    def create_sync(self, files, git_path="3.6"):
+        """Creates an upstream repository and the python3 dist-git repository
+
+        Returns:
+            tuple: The upstream repository and images syncing git_path into python3
+        """
+        upstream = create_upstream(os.path.join(self.tmp, "upstream"), files)
+        repo = self.create_downstream(["python3"])["python3"]
+        images = [{"name": "python-36", "component": "python3",
+                   "git_branch": repo.active_branch.name,
+                   "git_url": upstream.working_tree_dir, "git_path": git_path,
+                   "commands": {}}]
+        return upstream, images
 
     def test_setup_distgit(self):
         super(DistgitTestCase, self).setUp()
@@ -31,6 +81,355 @@ class DistgitTestCase(TestCaseBase):
         dpath = os.path.join(cpath, 'base', 'Dockerfile')
         self.assertTrue(os.path.isfile(dpath))
 
+    def test_prepare_upstreams_shared(self):
+        url = os.path.join(self.tmp, "upstream")
+        create_upstream(url, {"base/Dockerfile": "FROM a", "core/Dockerfile": "FROM b"})
+        images = [{"name": "s2i-base", "component": "s2i-base", "git_url": url,
+                   "git_path": "base", "commands": {}},
+                  {"name": "s2i-core", "component": "s2i-core", "git_url": url,
+                   "git_path": "core", "commands": {}},
+                  {"name": "s2i-extra", "component": "s2i-extra", "git_url": url,
+                   "git_path": "core", "commands": {"1": "touch extra"}}]
+        paths = self.ir.distgit.prepare_upstreams(images, os.path.join(self.tmp, "work"))
+        self.assertEqual(paths["s2i-base"], paths["s2i-core"])
+        self.assertNotEqual(paths["s2i-base"], paths["s2i-extra"])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp, "work"))), ["s2i", "s2i-2"])
+        self.assertTrue(os.path.isfile(os.path.join(paths["s2i-extra"], "extra")))
+        self.assertFalse(os.path.isfile(os.path.join(paths["s2i-base"], "extra")))
+
+    def test_commands_snapshot(self):
+        url = os.path.join(self.tmp, "upstream")
+        create_upstream(url, {"Makefile": "", "3.6/Dockerfile.in": "FROM a"})
+        # The last command leaves a mark next to the clone
+        commands = {"1": "cp 3.6/Dockerfile.in 3.6/Dockerfile", "2": "rm Makefile",
+                    "3": "touch ../commands-run"}
+        images = [{"name": "python-36", "component": "python3", "git_url": url,
+                   "git_path": "3.6", "commands": commands}]
+        for workdir in ("first", "second"):
+            paths = self.ir.distgit.prepare_upstreams(images, os.path.join(self.tmp, workdir))
+            ups_path = paths["python3"]
+            self.assertTrue(os.path.isfile(os.path.join(ups_path, "3.6", "Dockerfile")))
+            self.assertFalse(os.path.exists(os.path.join(ups_path, "Makefile")))
+        # The second clone got the result restored without running commands
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "first", "commands-run")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "second", "commands-run")))
+
+    def test_shared_submodules(self):
+        # Local submodule URLs are not allowed by default
+        env = {"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "protocol.file.allow",
+               "GIT_CONFIG_VALUE_0": "always"}
+        for key in env:
+            self.addCleanup(os.environ.pop, key, None)
+        os.environ.update(env)
+        common = os.path.join(self.tmp, "common")
+        create_upstream(common, {"lib.sh": "lib"})
+        images = []
+        for name in ("python", "ruby"):
+            url = os.path.join(self.tmp, name)
+            repo = create_upstream(url, {"Dockerfile": "FROM a"})
+            repo.git.submodule("add", common, "common")
+            repo.git.commit("-m", "Add common")
+            images.append({"name": name, "component": name, "git_url": url,
+                           "git_path": "", "commands": {}})
+        paths = self.ir.distgit.prepare_upstreams(images, os.path.join(self.tmp, "work"))
+        mirror = self.ir.distgit.mirrors.mirror_path(common)
+        self.assertTrue(os.path.isdir(mirror))
+        for path in paths.values():
+            self.assertTrue(os.path.isfile(os.path.join(path, "common", "lib.sh")))
+            alternates = os.path.join(path, ".git", "modules", "common", "objects",
+                                      "info", "alternates")
+            self.assertTrue(os.path.isfile(alternates))
+
+    def test_snapshot_submodules(self):
+        env = {"GIT_CONFIG_COUNT": "1", "GIT_CONFIG_KEY_0": "protocol.file.allow",
+               "GIT_CONFIG_VALUE_0": "always"}
+        for key in env:
+            self.addCleanup(os.environ.pop, key, None)
+        os.environ.update(env)
+        common = os.path.join(self.tmp, "common")
+        create_upstream(common, {"lib.sh": "lib"})
+        url = os.path.join(self.tmp, "python")
+        repo = create_upstream(url, {"Dockerfile": "FROM a"})
+        repo.git.submodule("add", common, "common")
+        repo.git.commit("-m", "Add common")
+        images = [{"name": "python", "component": "python", "git_url": url,
+                   "git_path": "", "commands": {"1": "touch common/generated",
+                                                "2": "rm common/lib.sh",
+                                                "3": "touch ../commands-run"}}]
+        # Files changed in the submodule are stored in the snapshot
+        for workdir in ("first", "second"):
+            paths = self.ir.distgit.prepare_upstreams(images, os.path.join(self.tmp, workdir))
+            submodule = os.path.join(paths["python"], "common")
+            self.assertTrue(os.path.isfile(os.path.join(submodule, "generated")))
+            self.assertFalse(os.path.exists(os.path.join(submodule, "lib.sh")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "second", "commands-run")))
+        # Another commit checked out in the submodule cannot be stored
+        images[0]["commands"] = {"1": "git -C common checkout --detach HEAD~0",
+                                 "2": "git -C common commit --allow-empty -m x"}
+        for workdir in ("third", "fourth"):
+            paths = self.ir.distgit.prepare_upstreams(images, os.path.join(self.tmp, workdir))
+        self.assertEqual(len(os.listdir(self.ir.distgit.snapshots.path)), 1)
+
+    def test_sparse_clone(self):
+        url = os.path.join(self.tmp, "upstream")
+        files = {"3.6/Dockerfile": "FROM a", "3.7/Dockerfile": "FROM b",
+                 "common/run": "run", "common/other": "other"}
+        create_upstream(url, files, links={"3.6/run": "../common/run"})
+        images = [{"name": "python-36", "component": "python3", "git_path": "3.6",
+                   "git_url": "file://" + url, "commands": {},
+                   "clone_strategy": "sparse"}]
+        paths = self.ir.distgit.prepare_upstreams(images, os.path.join(self.tmp, "work"))
+        ups_path = paths["python3"]
+        self.assertTrue(os.path.isfile(os.path.join(ups_path, "3.6", "run")))
+        self.assertFalse(os.path.exists(os.path.join(ups_path, "3.7")))
+        self.assertFalse(os.path.exists(os.path.join(ups_path, "common", "other")))
+
+    def test_upstream_unchanged(self):
+        url = os.path.join(self.tmp, "upstream")
+        create_upstream(url, {"3.6/Dockerfile": "FROM a", "3.6/README.md": "x",
+                              "common/lib.sh": "lib"},
+                        links={"3.6/lib.sh": "../common/lib.sh"})
+        downstream = os.path.join(self.tmp, "python3")
+        repo = create_upstream(downstream, {".gitignore": "downstream", "Dockerfile": "FROM b"})
+        distgit = self.ir.distgit
+        manifest = distgit._upstream_manifest(os.path.join(url, "3.6"), downstream)
+        self.assertFalse(distgit._upstream_unchanged(repo, manifest, url))
+        changed, removed = distgit._pull_upstream(downstream, "3.6", url, repo,
+                                                  manifest=manifest)
+        distgit._stage(repo, changed, removed)
+        repo.git.commit("-m", "Pull upstream")
+        self.assertTrue(distgit._upstream_unchanged(repo, manifest, url))
+        self.assertTrue(os.path.isfile(os.path.join(downstream, "lib.sh")))
+
+    def test_pull_type_changes(self):
+        url = os.path.join(self.tmp, "upstream")
+        create_upstream(url, {"3.6/Dockerfile": "FROM a", "3.6/file/y": "y",
+                              "3.6/dir": "dir", "3.6/target/x": "x",
+                              "3.6/link/x": "x"},
+                        links={"3.6/dirlink": "target"})
+        downstream = os.path.join(self.tmp, "python3")
+        # Every path changes its type: file, directory or symlink
+        repo = create_upstream(downstream, {"Dockerfile": "FROM b", "file": "file",
+                                            "dir/x": "x", "dirlink/x": "x",
+                                            "target/x": "x"},
+                               links={"link": "target"})
+        distgit = self.ir.distgit
+        manifest = distgit._upstream_manifest(os.path.join(url, "3.6"), downstream)
+        changed, removed = distgit._pull_upstream(downstream, "3.6", url, repo,
+                                                  manifest=manifest)
+        distgit._stage(repo, changed, removed)
+        repo.git.commit("-m", "Pull upstream")
+        self.assertEqual(repo.git.status("--porcelain"), "")
+        self.assertTrue(distgit._upstream_unchanged(repo, manifest, url))
+        self.assertEqual(os.readlink(os.path.join(downstream, "dirlink")), "target")
+
+    def test_incremental_pull(self):
+        upstream, images = self.create_sync({"3.6/Dockerfile": "FROM a",
+                                             "3.6/README.md": "x"})
+        distgit = self.ir.distgit
+        distgit.dist_git_changes(images, incremental=True)
+        self.assertEqual(distgit._changed_images(images), [])
+        # Someone else pushes to dist-git, the local clone is not fetched
+        other = Repo.clone_from(os.path.join(self.tmp, "python3.git"),
+                                os.path.join(self.tmp, "other"))
+        other.index.commit("Other change")
+        other.remotes.origin.push()
+        self.assertEqual(distgit._changed_images(images), images)
+        # Once pulled again, the image is unchanged in every next run
+        distgit.dist_git_changes(images, incremental=True)
+        for _ in range(2):
+            self.assertEqual(distgit._changed_images(images), [])
+            distgit.dist_git_changes(images, incremental=True)
+        # New upstream commits are picked up again
+        upstream.index.remove(["3.6/README.md"], working_tree=True)
+        upstream.index.commit("Remove README")
+        self.assertEqual(distgit._changed_images(images), images)
+
+    def test_unchanged_labels(self):
+        _, images = self.create_sync({"3.6/Dockerfile": "FROM a\nLABEL Release=1\n"})
+        distgit = self.ir.distgit
+        # Labels are checked whether the upstream changed or not
+        with self.assertLogs(distgit.logger, "WARNING") as logs:
+            distgit.dist_git_changes(images)
+        self.assertIn("Wrong label 'Release='", "\n".join(logs.output))
+        with self.assertLogs(distgit.logger, "INFO") as logs:
+            distgit.dist_git_changes(images)
+        self.assertIn("No upstream changes in: python3", "\n".join(logs.output))
+        self.assertIn("Wrong label 'Release='", "\n".join(logs.output))
+
+    def test_incremental_state(self):
+        # Nothing to pull from upstream, the pull still finishes
+        upstream, images = self.create_sync({"3.6/Dockerfile": "FROM a"}, git_path="3.7")
+        distgit = self.ir.distgit
+        distgit.dist_git_changes(images, incremental=True)
+        self.assertEqual(distgit._changed_images(images), [])
+        # Settings changing the pulled content invalidate the state
+        changes = [{"git_ref": upstream.head.commit.hexsha},
+                   {"clone_strategy": "shallow"}]
+        for change in changes:
+            self.assertEqual(distgit._changed_images([dict(images[0], **change)]),
+                             [dict(images[0], **change)])
+        distgit.df_ext = ".rhel7"
+        self.assertEqual(distgit._changed_images(images), images)
+        distgit.df_ext = self.ir.conf.df_ext
+        self.ir.conf.ignore_files = self.ir.conf.ignore_files + ["extra"]
+        self.assertEqual(distgit._changed_images(images), images)
+
+    def test_push_changes(self):
+        for repo in self.create_downstream(["python3", "ruby"]).values():
+            repo.index.commit("Change")
+        # The remote of the second repository is gone
+        shutil.rmtree(os.path.join(self.tmp, "ruby.git"))
+        images = [{"component": "python3"}, {"component": "ruby"}]
+        results = self.ir.distgit.push_changes(self.tmp, images)
+        self.assertEqual([(r.component, r.status, r.attempts) for r in results],
+                         [("python3", "pushed", 1), ("ruby", "failed", 1)])
+        remote = Repo(os.path.join(self.tmp, "python3.git"))
+        self.assertEqual(remote.head.commit.message, "Change")
+
+    def test_push_retries(self):
+        hooks = {
+            # Fails with a network error the first time only
+            "python3": 'test -e ../first || { touch ../first; '
+                       'echo "fatal: the remote end hung up unexpectedly" >&2; exit 1; }',
+            # Never finishes in time, not retried
+            "ruby": "sleep 5",
+        }
+        repos = self.create_downstream(hooks)
+        for component, hook in hooks.items():
+            path = os.path.join(self.tmp, component + ".git", "hooks", "pre-receive")
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\n" + hook + "\n")
+            os.chmod(path, 0o755)
+            repos[component].index.commit("Change")
+        distgit = self.ir.distgit
+        distgit.push_timeout = 1
+        distgit.push_retries = 1
+        backoff = distgit_module.PUSH_BACKOFF
+        distgit_module.PUSH_BACKOFF = 0
+        self.addCleanup(setattr, distgit_module, "PUSH_BACKOFF", backoff)
+        images = [{"component": "python3"}, {"component": "ruby"}]
+        results = distgit.push_changes(self.tmp, images)
+        self.assertEqual([(r.component, r.status, r.attempts) for r in results],
+                         [("python3", "pushed", 2), ("ruby", "timeout", 1)])
+        self.assertLess(results[1].duration, 2)
+
+    def test_merge_future_branches(self):
+        repo = self.create_downstream(["python3"], branches=["f28", "f29"])["python3"]
+        branch = repo.active_branch.name
+        repo.index.commit("Change")
+        images = [{"component": "python3", "git_branch": branch,
+                   "git_futures": ["f28", "f29", "f30"]}]
+        self.ir.distgit.merge_future_branches(images)
+        # The primary checkout stays on the current branch
+        self.assertEqual(repo.active_branch.name, branch)
+        for future in ("f28", "f29"):
+            self.assertEqual(repo.heads[future].commit, repo.head.commit)
+        # There is no f30 branch to merge into
+        self.assertNotIn("f30", repo.heads)
+        self.assertEqual(repo.git.worktree("list").count("\n"), 0)
+
+    def test_check_scripts(self):
+        clean = create_upstream(os.path.join(self.tmp, "clean"), {"Dockerfile": "FROM a"})
+        affected = create_upstream(os.path.join(self.tmp, "affected"), {"Dockerfile": "FROM b"})
+        distgit = self.ir.distgit
+        counter = os.path.join(self.tmp, "runs")
+        script = "echo >> {}; if grep -q 'FROM b' Dockerfile; then echo affected >&2; exit 1; fi"
+        script = script.format(counter)
+        checks = [(name, repo.working_tree_dir, repo.working_tree_dir)
+                  for name, repo in (("clean", clean), ("affected", affected))]
+        summary = os.path.join(self.tmp, "summary.json")
+        results = distgit.check_scripts(script, checks, summary)
+        self.assertEqual([(r.status, r.output, r.cached) for r in results],
+                         [("OK", "", False), ("Affected", "affected", False)])
+        with open(summary) as f:
+            self.assertEqual([r["status"] for r in json.load(f)], ["OK", "Affected"])
+        # Unchanged repositories are not checked again
+        results = distgit.check_scripts(script, checks)
+        self.assertEqual([(r.status, r.cached) for r in results],
+                         [("OK", True), ("Affected", True)])
+        with open(os.path.join(affected.working_tree_dir, "Dockerfile"), "w") as f:
+            f.write("FROM c")
+        results = distgit.check_scripts(script, checks)
+        self.assertEqual([(r.status, r.cached) for r in results],
+                         [("OK", True), ("OK", False)])
+        with open(counter) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_check_script_file(self):
+        repo = create_upstream(os.path.join(self.tmp, "python3"), {"Dockerfile": "FROM a"})
+        os.makedirs(os.path.join(self.tmp, "scripts"))
+        os.chdir(os.path.join(self.tmp, "scripts"))
+        with open("check.sh", "w") as f:
+            f.write("#!/bin/sh\ngrep -q 'FROM a' Dockerfile\n")
+        os.chmod("check.sh", 0o755)
+        distgit = self.ir.distgit
+        # Resolved in the current directory, run in the checked one
+        result = distgit.check_script("python3", "./check.sh", repo.working_tree_dir)
+        self.assertEqual((result.status, result.cached), ("OK", False))
+        # Changes of the script invalidate cached results
+        with open("check.sh", "w") as f:
+            f.write("#!/bin/sh\ngrep -q 'FROM b' Dockerfile\n")
+        result = distgit.check_script("python3", "./check.sh", repo.working_tree_dir)
+        self.assertEqual((result.status, result.cached), ("Affected", False))
+
+    def test_check_shared_content(self):
+        upstream = create_upstream(os.path.join(self.tmp, "upstream"),
+                                   {"3.6/Dockerfile": "FROM a", "common/lib.sh": "ok"},
+                                   links={"3.6/lib.sh": "../common/lib.sh"})
+        distgit = self.ir.distgit
+        script = "! grep -q bad lib.sh"
+        path = upstream.working_tree_dir
+        checks = [("python3", os.path.join(path, "3.6"), path)]
+        self.assertEqual(distgit.check_scripts(script, checks)[0].status, "OK")
+        # Content shared through a symlink changes
+        with open(os.path.join(path, "common", "lib.sh"), "w") as f:
+            f.write("bad")
+        result = distgit.check_scripts(script, checks)[0]
+        self.assertEqual((result.status, result.cached), ("Affected", False))
+        result = distgit.check_scripts(script, checks)[0]
+        self.assertEqual((result.status, result.cached), ("Affected", True))
+        # The cache can be bypassed
+        upstream.git.checkout("--", "common/lib.sh")
+        result = distgit.check_scripts(script, checks, use_cache=False)[0]
+        self.assertEqual((result.status, result.cached), ("OK", False))
+
+    def test_report_git_changes(self):
+        create_upstream(os.path.join(self.tmp, "python3"), {"Dockerfile": "FROM a\n"})
+        repo = create_upstream(os.path.join(self.tmp, "ruby"), {"Dockerfile": "FROM b\n"})
+        with open(os.path.join(self.tmp, "ruby", "Dockerfile"), "w") as f:
+            f.write("FROM c\n" * 1000)
+        repo.git.commit("-am", "Update ruby")
+        out = io.StringIO()
+        self.ir.distgit.report_git_changes(self.tmp, ["python3", "ruby"], fmt="json",
+                                           limit=1000, out=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual([e["component"] for e in report], ["python3", "ruby"])
+        self.assertTrue(report[1]["subject"].endswith("Update ruby"))
+        self.assertIn("Dockerfile | 1001", report[1]["stat"])
+        self.assertEqual(len(report[1]["patch"]), 1000)
+        self.assertGreater(report[1]["truncated"], 0)
+        self.assertEqual(report[0]["truncated"], 0)
+        out = io.StringIO()
+        self.ir.distgit.report_git_changes(self.tmp, "python3", out=out)
+        self.assertTrue(out.getvalue().startswith("=== python3: "))
+        self.assertIn("+FROM a", out.getvalue())
+
+    def test_existing_downstream(self):
+        distgit = self.ir.distgit
+        distgit.workdirs = WorkdirRegistry()
+        create_upstream(os.path.join(self.tmp, "python3"), {"Dockerfile": "FROM a"})
+        # An empty repository is what an interrupted clone leaves behind
+        Repo.init(os.path.join(self.tmp, "ruby"))
+        distgit._clone_downstream("python3", "master", self.tmp)
+        self.assertEqual(distgit.workdirs.clone_state(os.path.join(self.tmp, "python3")),
+                         {"branch": "master"})
+        with self.assertRaises(RebuilderError):
+            distgit._clone_downstream("ruby", "master", self.tmp)
+        # Recorded clones are used without checking them
+        distgit.workdirs.record_clone(os.path.join(self.tmp, "ruby"), "master")
+        distgit._clone_downstream("ruby", "master", self.tmp)
+
     def test_distgit_changes(self):
         self.ir.dist_git_changes()
         tmp = self.ir._get_tmp_workdir()
@@ -45,5 +444,65 @@ class DistgitTestCase(TestCaseBase):
         self.assertEqual(self.ir.distgit.commit_msg, msg)
 
 
+class MirrorCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.url = os.path.join(self.tmp, "upstream")
+        self.upstream = create_upstream(self.url, {"Dockerfile": "FROM a"})
+        self.mirrors = MirrorCache(os.path.join(self.tmp, "mirrors"),
+                                   create_logger(sys.stderr, logging.ERROR))
+
+    def test_update(self):
+        head = self.upstream.head.commit.hexsha
+        self.upstream.git.tag("v1")
+        # Hosting refs such as pull requests are not mirrored
+        self.upstream.git.update_ref("refs/pull/1/head", head)
+        path = self.mirrors.update(self.url)
+        mirror = Repo(path)
+        self.assertTrue(mirror.bare)
+        refs = mirror.git.for_each_ref("--format=%(refname)").split()
+        self.assertEqual(sorted(refs), ["refs/heads/master", "refs/tags/v1"])
+        # Fetched at most once per run
+        self.upstream.git.commit("--allow-empty", "-m", "Second commit")
+        self.assertEqual(self.mirrors.update(self.url), path)
+        self.assertEqual(mirror.git.rev_parse("master"), head)
+
+    def test_fetch_new_commits(self):
+        path = self.mirrors.update(self.url)
+        self.upstream.git.commit("--allow-empty", "-m", "Second commit")
+        self.upstream.git.branch("-m", "master", "main")
+        self.mirrors.updated.clear()
+        self.assertEqual(self.mirrors.update(self.url), path)
+        mirror = Repo(path)
+        self.assertEqual(mirror.git.rev_parse("main"), self.upstream.head.commit.hexsha)
+        # Deleted branches are pruned
+        self.assertNotIn("refs/heads/master", mirror.git.for_each_ref("--format=%(refname)"))
+
+    def test_existing_mirror(self):
+        self.upstream.git.update_ref("refs/pull/1/head", "HEAD")
+        path = self.mirrors.mirror_path(self.url)
+        Repo.clone_from(url=self.url, to_path=path, mirror=True)
+        self.mirrors.update(self.url)
+        mirror = Repo(path)
+        self.assertEqual(mirror.git.for_each_ref("--format=%(refname)"), "refs/heads/master")
+        self.mirrors.updated.clear()
+        self.mirrors.update(self.url)
+        self.assertEqual(mirror.git.for_each_ref("--format=%(refname)"), "refs/heads/master")
+
+    def test_clone(self):
+        repo = self.mirrors.clone(self.url, os.path.join(self.tmp, "clone"))
+        self.assertEqual(repo.remote().url, self.url)
+        self.assertEqual(repo.head.commit.hexsha, self.upstream.head.commit.hexsha)
+        # Objects are borrowed from the mirror
+        alternates = os.path.join(repo.git_dir, "objects", "info", "alternates")
+        with open(alternates) as f:
+            self.assertIn(self.mirrors.mirror_path(self.url), f.read())
+        # Fetches from the clone go to the upstream repository
+        self.upstream.git.commit("--allow-empty", "-m", "Second commit")
+        repo.remote().fetch()
+        self.assertEqual(repo.git.rev_parse("origin/master"), self.upstream.head.commit.hexsha)
+
+
 if __name__ == '__main__':
     unittest.main()
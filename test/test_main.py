@@ -1,5 +1,10 @@
 import unittest
+import os
+import shutil
+import tempfile
 
+from container_workflow_tool import config
+from container_workflow_tool.config import Config
 from container_workflow_tool.utility import RebuilderError
 from test.common import TestCaseBase
 
@@ -7,9 +12,18 @@ from test.common import TestCaseBase
 class RebuilderTestCase(TestCaseBase):
 
     def test_set_config(self):
-        self.ir.set_config('default.yaml', release='fedora27')
+        self.set_config('default.yaml', release='fedora27')
         self.assertEqual(self.ir.conf.releases["fedora"]["current"], '27')
 
+    def test_future_branches(self):
+        path = os.path.join(os.path.dirname(config.__file__), "config", "default.yaml")
+        with open(path) as f:
+            data = f.read().replace('- "27"', '- "27"\n        - "28"', 1)
+        conf = Config(data, release="fedora26")
+        image = conf.base[0]
+        self.assertEqual(image["git_future"], "f27")
+        self.assertEqual(image["git_futures"], ["f27", "f28"])
+
     def test_do_images(self):
         self.ir.set_do_images('s2i-base')
         images = [i["component"] for i in self.ir._get_images()]
@@ -31,6 +45,22 @@ class RebuilderTestCase(TestCaseBase):
         self.ir.tmp_workdir = self.ir._get_tmp_workdir(setup_dir=False)
         self.assertEqual(self.ir.tmp_workdir, None)
 
+    def test_workdir_registry(self):
+        # Directories are not found by their name
+        unrelated = tempfile.mkdtemp(prefix="Testing")
+        self.addCleanup(shutil.rmtree, unrelated)
+        self.assertEqual(self.ir._get_tmp_workdir(setup_dir=False), None)
+        tmp = self.ir._get_tmp_workdir()
+        self.assertNotEqual(tmp, unrelated)
+        # Each configuration has its own working directory
+        self.set_config('default.yaml', release="fedora27")
+        self.assertEqual(self.ir._get_tmp_workdir(setup_dir=False), None)
+        self.set_config('default.yaml', release="fedora26")
+        self.assertEqual(self.ir._get_tmp_workdir(setup_dir=False), tmp)
+        self.ir.clear_cache()
+        self.assertFalse(os.path.exists(tmp))
+        self.assertEqual(self.ir._get_tmp_workdir(setup_dir=False), None)
+
     def test_set_workdir(self):
         with self.assertRaises(RebuilderError):
             self.ir.set_tmp_workdir('/tmp/nonexisting')
@@ -0,0 +1,105 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from git import Repo
+
+from container_workflow_tool import sync
+
+
+def write(path, content="", mode=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    if mode is not None:
+        os.chmod(path, mode)
+
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.ups = os.path.join(self.tmp, "upstream")
+        self.src = os.path.join(self.ups, "3.6")
+        self.dest = os.path.join(self.tmp, "downstream")
+        write(os.path.join(self.src, "Dockerfile"), "FROM base")
+        write(os.path.join(self.src, "root", "run"), "#!/bin/sh", mode=0o755)
+        write(os.path.join(self.ups, "common", "lib.sh"), "lib")
+        write(os.path.join(self.ups, "root-common", "conf"), "conf")
+        os.makedirs(os.path.join(self.src, "test"))
+        os.symlink("../../common/lib.sh", os.path.join(self.src, "test", "lib.sh"))
+        os.symlink("../root-common", os.path.join(self.src, "root-common"))
+        os.symlink("Dockerfile", os.path.join(self.src, "Dockerfile.alias"))
+        os.makedirs(self.dest)
+
+    def test_dangling_symlinks(self):
+        manifest = sync.build_manifest(self.src, self.dest)
+        self.assertEqual(manifest["test/lib.sh"][0], sync.FILE)
+        self.assertEqual(manifest["root-common"][0], sync.DIR)
+        self.assertEqual(manifest["root-common/conf"][0], sync.FILE)
+        self.assertEqual(manifest["Dockerfile.alias"], (sync.LINK, "Dockerfile"))
+
+    def test_link_resolver(self):
+        # The copied version shares a directory with links into it
+        os.symlink("../common", os.path.join(self.src, "common"))
+        os.symlink("../common/lib.sh", os.path.join(self.src, "test", "shared.sh"))
+        os.symlink("loop2", os.path.join(self.src, "loop1"))
+        os.symlink("loop1", os.path.join(self.src, "loop2"))
+        os.symlink("../missing", os.path.join(self.src, "missing"))
+        manifest, origins = {}, {}
+        for rel, entry, path in sync._walk(self.src):
+            manifest[rel], origins[rel] = entry, path
+        report = sync.LinkResolver(manifest, origins, self.dest).run()
+        # Symlinks into replaced directories are resolved after them
+        self.assertEqual(manifest["common"][0], sync.DIR)
+        self.assertEqual(manifest["test/shared.sh"], (sync.LINK, "../common/lib.sh"))
+        self.assertEqual(sorted(rel for rel, _ in report.replaced),
+                         ["common", "root-common", "test/lib.sh"])
+        self.assertEqual(sorted(report.cycles), ["loop1", "loop2"])
+        self.assertEqual(report.unresolved, ["missing"])
+
+    def test_sync_only_changes(self):
+        write(os.path.join(self.dest, "Dockerfile"), "FROM old")
+        write(os.path.join(self.dest, "removed"), "removed")
+        write(os.path.join(self.dest, "untracked"), "untracked")
+        write(os.path.join(self.dest, ".gitignore"), "downstream")
+        tracked = ["Dockerfile", "removed", ".gitignore"]
+        manifest = sync.build_manifest(self.src, self.dest)
+        changed, removed = sync.sync_tree(manifest, self.dest, tracked,
+                                          protected=[".gitignore"])
+        self.assertIn("Dockerfile", changed)
+        self.assertEqual(removed, ["removed"])
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, "untracked")))
+        self.assertTrue(os.path.isfile(os.path.join(self.dest, ".gitignore")))
+        self.assertTrue(os.access(os.path.join(self.dest, "root", "run"), os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(self.dest, "Dockerfile.alias")),
+                         "Dockerfile")
+        # A second run finds nothing to do
+        tracked = sorted(set(tracked + changed) - set(removed))
+        manifest = sync.build_manifest(self.src, self.dest)
+        result = sync.sync_tree(manifest, self.dest, tracked, protected=[".gitignore"])
+        self.assertEqual(result, ([], []))
+
+    def test_sync_mode_change(self):
+        manifest = sync.build_manifest(self.src, self.dest)
+        changed, _ = sync.sync_tree(manifest, self.dest, [])
+        tracked = sorted(changed)
+        # Upstream only makes a file executable
+        os.chmod(os.path.join(self.src, "Dockerfile"), 0o755)
+        manifest = sync.build_manifest(self.src, self.dest)
+        changed, removed = sync.sync_tree(manifest, self.dest, tracked)
+        self.assertEqual((changed, removed), (["Dockerfile"], []))
+        self.assertTrue(os.access(os.path.join(self.dest, "Dockerfile"), os.X_OK))
+
+    def test_tree_hash(self):
+        manifest = sync.build_manifest(self.src, self.dest)
+        sync.sync_tree(manifest, self.dest, [])
+        repo = Repo.init(self.dest)
+        repo.git.add("-A")
+        self.assertEqual(sync.tree_hash(sync.git_entries(manifest)),
+                         repo.git.write_tree())
+
+
+if __name__ == '__main__':
+    unittest.main()